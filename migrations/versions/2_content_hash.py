@@ -0,0 +1,24 @@
+"""
+
+Revision ID: 2_content_hash
+Revises: 1_dest_org
+Create Date: 2026-10-17
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "2_content_hash"
+down_revision = "1_dest_org"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('geoserver_resource', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    op.drop_column('geoserver_resource', 'content_hash')
@@ -0,0 +1,26 @@
+"""
+
+Revision ID: 3_source_validators
+Revises: 2_content_hash
+Create Date: 2026-10-17
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "3_source_validators"
+down_revision = "2_content_hash"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('geoserver_resource', sa.Column('etag', sa.String(length=256), nullable=True))
+    op.add_column('geoserver_resource', sa.Column('last_modified', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    op.drop_column('geoserver_resource', 'last_modified')
+    op.drop_column('geoserver_resource', 'etag')
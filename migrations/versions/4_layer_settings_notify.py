@@ -0,0 +1,58 @@
+"""
+
+Revision ID: 4_layer_settings_notify
+Revises: 3_source_validators
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "4_layer_settings_notify"
+down_revision = "3_source_validators"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the payload is the project whose settings changed, empty means every project
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION notify_layer_settings_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('layer_settings_changed', '');
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM pg_notify('layer_settings_changed', OLD.project);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM pg_notify('layer_settings_changed', NEW.project);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER layer_settings_changed
+        AFTER INSERT OR UPDATE OR DELETE ON layer_settings
+        FOR EACH ROW EXECUTE PROCEDURE notify_layer_settings_changed()
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER layer_settings_truncated
+        AFTER TRUNCATE ON layer_settings
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_layer_settings_changed()
+        """
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS layer_settings_truncated ON layer_settings")
+    op.execute("DROP TRIGGER IF EXISTS layer_settings_changed ON layer_settings")
+    op.execute("DROP FUNCTION IF EXISTS notify_layer_settings_changed()")
@@ -0,0 +1,43 @@
+"""
+
+Revision ID: 5_live_layer_unique
+Revises: 4_layer_settings_notify
+Create Date: 2026-10-17
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "5_live_layer_unique"
+down_revision = "4_layer_settings_notify"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keep only the most recent live entry of each layer before enforcing uniqueness
+    op.execute(
+        """
+        UPDATE geoserver_resource AS r
+        SET deleted_at = now() AT TIME ZONE 'utc'
+        FROM geoserver_resource AS newer
+        WHERE r.deleted_at IS NULL
+            AND newer.deleted_at IS NULL
+            AND newer.workspace = r.workspace
+            AND newer.layer_name = r.layer_name
+            AND newer.id > r.id
+        """
+    )
+    op.create_index(
+        'ix_geoserver_resource_live_layer',
+        'geoserver_resource',
+        ['workspace', 'layer_name'],
+        unique=True,
+        postgresql_where=sa.text('deleted_at IS NULL'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_geoserver_resource_live_layer', table_name='geoserver_resource')
@@ -0,0 +1,55 @@
+"""
+
+Revision ID: 6_time_mosaic_granules
+Revises: 5_live_layer_unique
+Create Date: 2026-10-17
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "6_time_mosaic_granules"
+down_revision = "5_live_layer_unique"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('geoserver_resource', sa.Column('granule', sa.Boolean(), server_default='0', nullable=True))
+    # the resources of a datatype published as a time-enabled mosaic share its layer
+    op.drop_index('ix_geoserver_resource_live_layer', table_name='geoserver_resource')
+    op.create_index(
+        'ix_geoserver_resource_live_layer',
+        'geoserver_resource',
+        ['workspace', 'layer_name', 'resource_id'],
+        unique=True,
+        postgresql_where=sa.text('deleted_at IS NULL'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_geoserver_resource_live_layer', table_name='geoserver_resource')
+    # granules of a mosaic share its layer: keep only the most recent live entry of each layer,
+    # as in 5_live_layer_unique, the older granules stay in the mosaic but are no longer tracked
+    op.execute(
+        """
+        UPDATE geoserver_resource AS r
+        SET deleted_at = now() AT TIME ZONE 'utc'
+        FROM geoserver_resource AS newer
+        WHERE r.deleted_at IS NULL
+            AND newer.deleted_at IS NULL
+            AND newer.workspace = r.workspace
+            AND newer.layer_name = r.layer_name
+            AND newer.id > r.id
+        """
+    )
+    op.create_index(
+        'ix_geoserver_resource_live_layer',
+        'geoserver_resource',
+        ['workspace', 'layer_name'],
+        unique=True,
+        postgresql_where=sa.text('deleted_at IS NULL'),
+    )
+    op.drop_column('geoserver_resource', 'granule')
@@ -0,0 +1,49 @@
+"""
+
+Revision ID: 7_resource_archive
+Revises: 6_time_mosaic_granules
+Create Date: 2026-10-17
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "7_resource_archive"
+down_revision = "6_time_mosaic_granules"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # purged tombstones of geoserver_resource, same columns without defaults, indexes and constraints
+    op.execute(
+        """
+        CREATE TABLE geoserver_resource_archive (
+            LIKE geoserver_resource,
+            archived_at timestamp with time zone NOT NULL DEFAULT now(),
+            PRIMARY KEY (id)
+        )
+        """
+    )
+    op.create_index(
+        'ix_geoserver_resource_archive_resource', 'geoserver_resource_archive', ['workspace', 'resource_id']
+    )
+    # the purge looks for tombstones only
+    op.create_index(
+        'ix_geoserver_resource_deleted_at',
+        'geoserver_resource',
+        ['deleted_at'],
+        postgresql_where=sa.text('deleted_at IS NOT NULL'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_geoserver_resource_deleted_at', table_name='geoserver_resource')
+    # archived tombstones go back to geoserver_resource
+    columns = ", ".join(
+        f'"{column["name"]}"' for column in sa.inspect(op.get_bind()).get_columns('geoserver_resource')
+    )
+    op.execute(f"INSERT INTO geoserver_resource ({columns}) SELECT {columns} FROM geoserver_resource_archive")
+    op.drop_table('geoserver_resource_archive')
@@ -0,0 +1,172 @@
+"""
+
+Revision ID: 8_resource_hot_indexes
+Revises: 7_resource_archive
+Create Date: 2026-10-17
+
+Indexes for the filters of the /layers and /resources endpoints.
+Large deployments can also partition geoserver_resource by month of created_at:
+
+    alembic -x partition_by_month=true upgrade head
+
+"""
+import sqlalchemy as sa
+from alembic import context, op
+
+
+# revision identifiers, used by Alembic.
+revision = "8_resource_hot_indexes"
+down_revision = "7_resource_archive"
+branch_labels = None
+depends_on = None
+
+# monthly partitions created ahead of time, the importer keeps adding them, see DataStorageManager
+PARTITIONS_AHEAD = 3
+
+HOT_INDEXES = [
+    # live layers of a workspace by datatype, most recent first
+    """ix_geoserver_resource_live_datatype ON geoserver_resource (workspace, datatype_id, created_at)
+    WHERE deleted_at IS NULL""",
+    # validity range of the layers, filtered with end >= :start and start <= :end
+    """ix_geoserver_resource_validity ON geoserver_resource (start, "end")""",
+]
+BBOX_INDEX = "ix_geoserver_resource_bbox ON geoserver_resource USING gist (bbox)"
+
+
+def upgrade():
+    partition = context.get_x_argument(as_dictionary=True).get("partition_by_month", "").lower() in ("true", "1")
+    if partition:
+        _partition_by_month()
+        # indexes of a partitioned table are created on every partition, CONCURRENTLY is not supported
+        for index in HOT_INDEXES + [BBOX_INDEX]:
+            op.execute(f"CREATE INDEX IF NOT EXISTS {index}")
+        return
+    # tables created by geoalchemy already have a spatial index on bbox
+    has_bbox_index = op.get_bind().execute(
+        sa.text(
+            "SELECT EXISTS (SELECT 1 FROM pg_indexes "
+            "WHERE tablename = 'geoserver_resource' AND indexdef ILIKE '%USING gist (bbox)%')"
+        )
+    ).scalar()
+    # without blocking the writes of the importer
+    with op.get_context().autocommit_block():
+        for index in HOT_INDEXES if has_bbox_index else HOT_INDEXES + [BBOX_INDEX]:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index}")
+
+
+def downgrade():
+    partitioned = op.get_bind().execute(
+        sa.text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+            "WHERE partrelid = to_regclass('geoserver_resource'))"
+        )
+    ).scalar()
+    if partitioned:
+        _unpartition()
+    op.execute("DROP INDEX IF EXISTS ix_geoserver_resource_bbox")
+    op.execute("DROP INDEX IF EXISTS ix_geoserver_resource_validity")
+    op.execute("DROP INDEX IF EXISTS ix_geoserver_resource_live_datatype")
+    op.execute("DROP FUNCTION IF EXISTS create_geoserver_resource_partitions(timestamp, integer)")
+
+
+def _partition_by_month():
+    sequence = op.get_bind().execute(sa.text("SELECT pg_get_serial_sequence('geoserver_resource', 'id')")).scalar()
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    op.execute("ALTER TABLE geoserver_resource RENAME TO geoserver_resource_unpartitioned")
+    op.execute(
+        """
+        CREATE TABLE geoserver_resource (
+            LIKE geoserver_resource_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY geoserver_resource.id")
+    # created_at is a UTC timestamp without time zone
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION create_geoserver_resource_partitions(since timestamp, months_ahead integer)
+        RETURNS integer AS $$
+        DECLARE
+            month_start timestamp := date_trunc('month', since);
+            last_month timestamp := date_trunc('month', now() AT TIME ZONE 'UTC')
+                + make_interval(months => months_ahead);
+            partition_name text;
+            created integer := 0;
+        BEGIN
+            WHILE month_start <= last_month LOOP
+                partition_name := 'geoserver_resource_' || to_char(month_start, 'YYYYMM');
+                IF to_regclass(partition_name) IS NULL THEN
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF geoserver_resource FOR VALUES FROM (%L) TO (%L)',
+                        partition_name, month_start, month_start + interval '1 month'
+                    );
+                    created := created + 1;
+                END IF;
+                month_start := month_start + interval '1 month';
+            END LOOP;
+            RETURN created;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    # rows outside the monthly partitions, e.g. with a creation date far in the future
+    op.execute("CREATE TABLE geoserver_resource_default PARTITION OF geoserver_resource DEFAULT")
+    op.execute(
+        f"""
+        SELECT create_geoserver_resource_partitions(
+            coalesce(min(created_at), now() AT TIME ZONE 'UTC'), {PARTITIONS_AHEAD}
+        )
+        FROM geoserver_resource_unpartitioned
+        """
+    )
+    op.execute("INSERT INTO geoserver_resource SELECT * FROM geoserver_resource_unpartitioned")
+    op.execute("DROP TABLE geoserver_resource_unpartitioned")
+    # added once the old table, with the constraint and index names, is gone
+    op.execute("ALTER TABLE geoserver_resource ADD PRIMARY KEY (id, created_at)")
+    # unique indexes of a partitioned table must include the partition key, so one on the live layers
+    # would no longer reject a second live entry: DataStorageManager.add_resources_entries checks it instead
+    op.execute(
+        """
+        CREATE INDEX ix_geoserver_resource_live_layer
+        ON geoserver_resource (workspace, layer_name, resource_id)
+        WHERE deleted_at IS NULL
+        """
+    )
+    op.execute(
+        "CREATE INDEX ix_geoserver_resource_deleted_at ON geoserver_resource (deleted_at) "
+        "WHERE deleted_at IS NOT NULL"
+    )
+    op.execute("ANALYZE geoserver_resource")
+
+
+def _unpartition():
+    sequence = op.get_bind().execute(sa.text("SELECT pg_get_serial_sequence('geoserver_resource', 'id')")).scalar()
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    op.execute("ALTER TABLE geoserver_resource RENAME TO geoserver_resource_partitioned")
+    op.execute(
+        """
+        CREATE TABLE geoserver_resource (
+            LIKE geoserver_resource_partitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+        )
+        """
+    )
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY geoserver_resource.id")
+    op.execute("INSERT INTO geoserver_resource SELECT * FROM geoserver_resource_partitioned")
+    # the partitions are dropped with their parent
+    op.execute("DROP TABLE geoserver_resource_partitioned")
+    op.execute("ALTER TABLE geoserver_resource ADD PRIMARY KEY (id)")
+    op.create_index(
+        'ix_geoserver_resource_live_layer',
+        'geoserver_resource',
+        ['workspace', 'layer_name', 'resource_id'],
+        unique=True,
+        postgresql_where=sa.text('deleted_at IS NULL'),
+    )
+    op.create_index(
+        'ix_geoserver_resource_deleted_at',
+        'geoserver_resource',
+        ['deleted_at'],
+        postgresql_where=sa.text('deleted_at IS NOT NULL'),
+    )
+    # spatial index named as the one created by geoalchemy with the table
+    op.execute("CREATE INDEX idx_geoserver_resource_bbox ON geoserver_resource USING gist (bbox)")
@@ -1,14 +1,17 @@
 import logging
-from datetime import datetime, timedelta
-from typing import List
 
 from importer.database.extensions import db_session
-from importer.database.models import GeoserverResource
 from importer.database.schemas import MessageSchema
+from importer.driver.datalake_driver import ResourceNotModified
+from importer.dto.import_work_item import ImportWorkItem
 from importer.manager.data_retrieval_manager import DataRetrievalManager
 from importer.manager.data_storage_manager import DataStorageManager
 from importer.manager.geoserver_manager import GeoserverManager
 from importer.manager.message_bus_manager import MessageBusManager
+from importer.manager.pipeline_manager import PipelineManager, PipelineStage
+from importer.manager.purge_manager import PurgeManager
+from importer.manager.retention_manager import RetentionManager
+from importer.manager.trash_reaper import trash_reaper
 from importer.settings.instance import settings
 
 LOG_FORMAT = "%(levelname) -10s %(asctime)s %(name) -30s %(funcName) -35s %(lineno) -5d: %(message)s"
@@ -18,6 +21,8 @@ LOG = logging.getLogger(__name__)
 data_retrieval_manager = DataRetrievalManager()
 data_storage_manager = DataStorageManager()
 geoserver_manager = GeoserverManager()
+retention_manager = RetentionManager(data_storage_manager, geoserver_manager)
+purge_manager = PurgeManager(data_storage_manager)
 
 
 def main():
@@ -34,84 +39,125 @@ def main():
         except (KeyError, TypeError, AttributeError):
             LOG.info("No project info found in notification, setting default project name")
             project_name = settings.geoserver_workspace
+        # exceptions reach the consumer, which rejects the message instead of acknowledging it
+        message_schema, errors = check_message(message)
+        if len(errors) > 0:
+            for error in errors:
+                LOG.error(error)
+            return
+        LOG.info(message_schema.type)
+        # the retention thread does not delete the resource while it is imported
+        with data_storage_manager.resource_locks.hold([(project_name, message_schema.id)]):
+            item = pipeline.process(ImportWorkItem(project_name, message_schema))
+        # downloads are normally consumed by the store stage, unless the item stopped before it
+        data_storage_manager.discard_downloads(item.data_list)
+        if not item.success:
+            # a stage failed, the message must not be acknowledged
+            raise item.error
+
+    def download_stage(item: ImportWorkItem) -> bool:
+        message_schema = item.message
+        if message_schema.type not in ["create", "update"]:
+            return True
+        etag, last_modified = None, None
+        if message_schema.type == "update":
+            with db_session() as session:
+                etag, last_modified = data_storage_manager.get_source_validators(
+                    session, workspace=item.workspace, resource_id=message_schema.id
+                )
         try:
-            message_schema, errors = check_message(message)
-            if len(errors) > 0:
-                for error in errors:
-                    LOG.error(error)
-                return
-            LOG.info(message_schema.type)
-            if message_schema.type in ["delete", "update"]:
-                with db_session() as session:
-                    resources = data_storage_manager.get_resources(
-                        session=session, workspace=project_name, resource_id=message_schema.id
-                    )
-                    LOG.info(resources)
-                    reslayercount = data_storage_manager.countlayers_perresource(session=session, resources=resources)
-                    geoserver_manager.delete(resources=resources, resourcelayercount=reslayercount)
-                    data_storage_manager.delete_resources(session, resources, resourcelayercount=reslayercount)
-            if message_schema.type in ["create", "update"]:
-                data_list = data_retrieval_manager.download_data(project_name, message_schema=message_schema)
-                saved_resources = data_storage_manager.save_resources(data_list=data_list)
-                publication_status = geoserver_manager.publish(resources=saved_resources)
-                data_storage_manager.add_resources_entries(saved_resources, publication_status)
-                message_bus_manager.publication_report(saved_resources, publication_status)
-                impacted_datatypes = list(set(ps.datatype for ps in publication_status if ps.success))
-                delete_oldest_resources(workspace=project_name, datatypes=impacted_datatypes)
-        except Exception as e:
-            LOG.error(e, exc_info=True)
-
-    def delete_oldest_resources(workspace: str, datatypes: List[str] = None):
+            item.data_list = data_retrieval_manager.download_data(
+                item.workspace, message_schema=message_schema, etag=etag, last_modified=last_modified
+            )
+        except ResourceNotModified as e:
+            LOG.info(e)
+            refresh_unchanged_resource(item.workspace, message_schema)
+            return False
+        if message_schema.type == "update":
+            content_hash = item.data_list[0].content_hash if len(item.data_list) == 1 else None
+            if content_hash and refresh_unchanged_resource(item.workspace, message_schema, content_hash):
+                data_storage_manager.discard_downloads(item.data_list)
+                return False
+        return True
+
+    def store_stage(item: ImportWorkItem) -> bool:
+        if item.message.type in ["delete", "update"]:
+            delete_resource(workspace=item.workspace, resource_id=item.message.id)
+        if item.message.type not in ["create", "update"]:
+            return False
+        item.saved_resources = data_storage_manager.save_resources(data_list=item.data_list)
+        return True
+
+    def publish_stage(item: ImportWorkItem) -> bool:
+        item.publication_status = geoserver_manager.publish(resources=item.saved_resources)
+        data_storage_manager.add_resources_entries(item.saved_resources, item.publication_status)
+        return True
+
+    def report_stage(item: ImportWorkItem) -> bool:
+        message_bus_manager.publication_report(item.saved_resources, item.publication_status)
+        impacted_datatypes = list(set(ps.datatype for ps in item.publication_status if ps.success))
+        # new layers may exceed delete_after_count, retention runs in its own thread
+        retention_manager.schedule(item.workspace, impacted_datatypes)
+        return True
+
+    def delete_resource(workspace: str, resource_id: str):
         with db_session() as session:
-            expired_resources = []
-            for dtype in datatypes:
-
-                try:
-                    delete_after_days = data_storage_manager.get_layer_settings(
-                        session, project=workspace, datatype_id=dtype
-                    ).delete_after_days
-                except AttributeError:
-                    delete_after_days = None
-
-                try:
-                    delete_after_count = data_storage_manager.get_layer_settings(
-                        session, project=workspace, datatype_id=dtype
-                    ).delete_after_count
-                except Exception:
-                    delete_after_count = None
+            resources = data_storage_manager.get_resources(
+                session=session, workspace=workspace, resource_id=resource_id
+            )
+            LOG.info(resources)
+            reslayercount = data_storage_manager.countlayers_perresource(session=session, resources=resources)
+            # detached, so that they stay readable after the commit, while GeoServer is called outside the transaction
+            session.expunge_all()
+        errors = geoserver_manager.delete(resources=resources, resourcelayercount=reslayercount)
+        deleted = [resource for resource in resources if errors.get(resource.id) is None]
+        with db_session() as session:
+            data_storage_manager.delete_resources(session, deleted, resourcelayercount=reslayercount)
 
+    def refresh_unchanged_resource(workspace: str, message_schema: MessageSchema, content_hash: str = None) -> bool:
+        """If the payload of an update is identical to the published one, refresh metadata only.
+        Without content_hash, the Data Lake already confirmed that the resource did not change."""
+        with db_session() as session:
+            if content_hash:
+                resources = data_storage_manager.get_unchanged_resources(
+                    session, workspace=workspace, resource_id=message_schema.id, content_hash=content_hash
+                )
+            else:
                 resources = data_storage_manager.get_resources(
-                    session=session, workspace=workspace, datatype_ids=[dtype], expire_on=datetime.utcnow()
+                    session=session, workspace=workspace, resource_id=message_schema.id
                 )
-                expired_resources.extend(resources)
-
-                if delete_after_days and delete_after_days > 0:
-                    resources = data_storage_manager.get_resources(
-                        session=session,
-                        workspace=workspace,
-                        datatype_ids=[dtype],
-                        created_before=(datetime.utcnow() - timedelta(days=delete_after_days)),
-                    )
-                    expired_resources.extend(resources)
-
-                if delete_after_count and delete_after_count > 0:
-                    resources = data_storage_manager.get_resources(
-                        session=session,
-                        workspace=workspace,
-                        datatype_ids=[dtype],
-                        order_by=GeoserverResource.created_at,
-                    )
-                    expired_resources.extend(resources[:-delete_after_count])
-
-            LOG.info(
-                f"Expired resources to delete (datatype {datatypes}): {[r.resource_id for r in expired_resources]}"
-            )
-            reslayercount = data_storage_manager.countlayers_perresource(session=session, resources=expired_resources)
-            geoserver_manager.delete(resources=expired_resources, resourcelayercount=reslayercount)
-            data_storage_manager.delete_resources(session, expired_resources, resourcelayercount=reslayercount)
-
+            if not resources:
+                return False
+            LOG.info(f"Resource {message_schema.id} content unchanged, skipping republication")
+            data_storage_manager.refresh_resources(session, resources, message_schema)
+            # detached, so that they stay readable after the commit, while GeoServer is called outside the transaction
+            session.expunge_all()
+        geoserver_manager.update_titles(resources, title=message_schema.name)
+        return True
+
+    queue_size = settings.pipeline_queue_size
+    pipeline = PipelineManager(
+        [
+            PipelineStage("download", download_stage, settings.pipeline_download_workers, queue_size),
+            PipelineStage("store", store_stage, settings.pipeline_store_workers, queue_size),
+            PipelineStage("publish", publish_stage, settings.pipeline_publish_workers, queue_size),
+            PipelineStage("report", report_stage, settings.pipeline_report_workers, queue_size),
+        ]
+    )
+    geoserver_manager.load_catalog()
+    trash_reaper.start()
+    retention_manager.start()
+    purge_manager.start()
+    if retention_manager.dry_run:
+        for entry in retention_manager.report():
+            LOG.info(f"[dry run] retention due: {entry}")
     message_bus_manager = MessageBusManager()
-    message_bus_manager.consume(callback=callback)
+    try:
+        message_bus_manager.consume(callback=callback)
+    finally:
+        retention_manager.stop()
+        purge_manager.stop()
+        trash_reaper.stop()
 
 
 if __name__ == "__main__":
@@ -13,11 +13,11 @@ from importer.__main__ import LOG
 from importer.api.dashboard import domain
 from importer.api.dashboard.dto import TimeSeriesSchema_v2
 from importer.database.extensions import db_webserver
+from importer.database.layer_settings_cache import layer_settings_cache
 from importer.database.models import GeoserverResource
 from importer.database.schemas import GeoserverResourceSchema
 from importer.driver.geoserver_driver import GeoserverDriver
 from importer.driver.postgis_driver import PostGISDriver
-from importer.manager.data_storage_manager import DataStorageManager
 from importer.manager.geoserver_manager import GeoserverManager
 from importer.settings.instance import settings
 from importer.util.datetimeutils import isoformat_Z, set_utc_default_tz
@@ -253,10 +253,7 @@ def get_timeseries(params: TimeSeriesSchema_v2 = Depends(),
     By specifying these parameters, the API will return a dataframe containing the `temperature` values at the requested point location over the specified time period. If multiple files span the same time period (same `date_start`), the most recent file will be chosen using the `creation_date_col`.
     """
 
-    data_storage_manager = DataStorageManager()
-    layer_settings = data_storage_manager.get_layer_settings(
-        db, project=params.workspace, datatype_id=params.datatype_id
-    )
+    layer_settings = layer_settings_cache.get(params.workspace, params.datatype_id)
 
     if not layer_settings:
         raise HTTPException(status_code=404, detail="Settings for those parameters not found in DB")
@@ -0,0 +1,137 @@
+import logging
+import select
+import threading
+import time
+from typing import Dict, List, Optional
+
+from importer.database.extensions import db_session
+from importer.database.models import LayerSettings
+from importer.database.schemas import LayerSettingsSchema
+from importer.database.session import engine
+from importer.settings.instance import settings
+
+LOG = logging.getLogger(__name__)
+
+# channel notified by the layer_settings trigger, see migration 4_layer_settings_notify
+NOTIFY_CHANNEL = "layer_settings_changed"
+
+
+class ProjectLayerSettings:
+    """Snapshot of the layer settings of a project, indexed by datatype_id and master_datatype_id"""
+
+    def __init__(self, rows: List[LayerSettingsSchema]):
+        self.loaded_at = time.monotonic()
+        self.by_datatype: Dict[str, LayerSettingsSchema] = {}
+        self.by_master_datatype: Dict[str, List[LayerSettingsSchema]] = {}
+        for row in rows:
+            self.by_datatype.setdefault(row.datatype_id, row)
+            if row.master_datatype_id:
+                self.by_master_datatype.setdefault(row.master_datatype_id, []).append(row)
+
+
+class LayerSettingsCache:
+    """
+    In-process cache of the layer_settings table.
+    The settings of a project are loaded in bulk on first access and kept for layer_settings_cache_ttl seconds,
+    or until Postgres notifies a change of the table.
+    """
+
+    def __init__(self, ttl: int, listen: bool = True):
+        """
+        :param ttl:    seconds after which a project is reloaded, 0 disables the cache
+        :param listen: whether to LISTEN for changes of the table and invalidate the cache immediately
+        """
+        self.ttl = ttl
+        self.listen = listen and ttl > 0
+        self._projects: Dict[str, ProjectLayerSettings] = {}
+        # bumped by every invalidation, so that loads racing with a change are not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+
+    def get(self, project: str, datatype_id) -> Optional[LayerSettingsSchema]:
+        """Settings of the given datatype, None if missing"""
+        return self._get_project(project).by_datatype.get(str(datatype_id))
+
+    def get_by_master(self, project: str, master_datatype_id) -> List[LayerSettingsSchema]:
+        """Settings of the variables sharing the given master datatype (e.g. NetCDF layers)"""
+        return self._get_project(project).by_master_datatype.get(str(master_datatype_id), [])
+
+    def invalidate(self, project: Optional[str] = None):
+        """Drops the cached settings of a project, or of every project if None"""
+        with self._lock:
+            self._generation += 1
+            if project is None:
+                self._projects.clear()
+            else:
+                self._projects.pop(project, None)
+
+    def _get_project(self, project: str) -> ProjectLayerSettings:
+        self._start_listener()
+        with self._lock:
+            cached = self._projects.get(project)
+            generation = self._generation
+        if cached is not None and time.monotonic() - cached.loaded_at < self.ttl:
+            return cached
+        loaded = self._load(project)
+        if self.ttl > 0:
+            with self._lock:
+                if generation == self._generation:
+                    self._projects[project] = loaded
+        return loaded
+
+    @staticmethod
+    def _load(project: str) -> ProjectLayerSettings:
+        with db_session() as session:
+            rows = session.query(LayerSettings).filter(LayerSettings.project == project).all()
+            snapshot = ProjectLayerSettings([LayerSettingsSchema.from_orm(row) for row in rows])
+        LOG.debug(f"Loaded {len(rows)} layer settings for project {project}")
+        return snapshot
+
+    def _start_listener(self):
+        if not self.listen or self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen, name="layer-settings-listener", daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                # the connection keeps listening, it must not go back to the pool
+                connection.detach()
+                connection.set_session(autocommit=True)
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # changes may have been missed while (re)connecting
+                self.invalidate()
+                LOG.info(f"Listening for changes of layer settings on channel {NOTIFY_CHANNEL}")
+                while True:
+                    if select.select([connection], [], [], 60) == ([], [], []):
+                        continue
+                    connection.poll()
+                    projects = []
+                    while connection.notifies:
+                        projects.append(connection.notifies.pop(0).payload)
+                    for project in set(projects):
+                        LOG.info(f"Layer settings changed, invalidating cache of project {project or 'all'}")
+                        self.invalidate(project or None)
+            except Exception as e:
+                LOG.error(f"Layer settings listener failed, retrying: {e}")
+                self.invalidate()
+                time.sleep(10)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+
+layer_settings_cache = LayerSettingsCache(
+    ttl=settings.layer_settings_cache_ttl, listen=settings.layer_settings_cache_listen
+)
@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from geoalchemy2 import Geometry
-from sqlalchemy import Boolean, Column, Integer, String, Text
+from sqlalchemy import Boolean, Column, Index, Integer, String, Text, text
 
 from importer.database import APIModel, TimezoneDateTime
 
@@ -26,6 +26,34 @@ class GeoserverResource(APIModel):
     request_code = Column(String(128), nullable=True)
     timestamps = Column(Text, nullable=False)
     mosaic = Column(Boolean, server_default="0")
+    content_hash = Column(String(64), nullable=True)  # sha256 of the downloaded payload
+    etag = Column(String(256), nullable=True)  # validators of the download, for conditional requests
+    last_modified = Column(String(64), nullable=True)
+    granule = Column(Boolean, server_default="0")  # resource published as granules of the datatype mosaic
+
+    __table_args__ = (
+        # a layer has at most one live entry per resource (granules share the mosaic layer),
+        # see migration 6_time_mosaic_granules; not unique once partitioned by migration 8_resource_hot_indexes
+        Index(
+            "ix_geoserver_resource_live_layer",
+            "workspace",
+            "layer_name",
+            "resource_id",
+            unique=True,
+            postgresql_where=text("deleted_at IS NULL"),
+        ),
+        # tombstones waiting to be purged, see migration 7_resource_archive
+        Index("ix_geoserver_resource_deleted_at", "deleted_at", postgresql_where=text("deleted_at IS NOT NULL")),
+        # filters of the /layers and /resources endpoints, see migration 8_resource_hot_indexes
+        Index(
+            "ix_geoserver_resource_live_datatype",
+            "workspace",
+            "datatype_id",
+            "created_at",
+            postgresql_where=text("deleted_at IS NULL"),
+        ),
+        Index("ix_geoserver_resource_validity", "start", "end"),
+    )
 
 
 class LayerSettings(APIModel):
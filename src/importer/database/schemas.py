@@ -44,6 +44,9 @@ class DownloadedDataSchema(BaseModel):
     request_code: str
     mosaic: bool
     additional_attributes: Optional[dict]
+    content_hash: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
 
 
 def ewkb_to_wkt(geom: WKBElement):
@@ -75,6 +78,10 @@ class GeoserverResourceSchema(ORMModel):
     request_code: Optional[str]  # used for all kind of data,
     timestamps: Optional[str]  # used for all kind of data
     mosaic: bool  # Storage location is a directory - import as ImageMosaic
+    granule: Optional[bool] = False  # Files added as granules to the time-enabled mosaic of the datatype
+    content_hash: Optional[str]  # sha256 of the downloaded payload, used to skip identical updates
+    etag: Optional[str]  # ETag of the download, used for conditional requests
+    last_modified: Optional[str]  # Last-Modified of the download, used for conditional requests
 
     @validator("bbox", pre=True, allow_reuse=True, whole=True, always=True)
     def correct_geom_format(cls, v):
@@ -86,13 +93,13 @@ class GeoserverResourceSchema(ORMModel):
 
 class LayerSettingsSchema(ORMModel):
     project: str
-    master_datatype_id: str  # used for all kind of data
+    master_datatype_id: Optional[str]  # used for all kind of data
     datatype_id: str  # used for all kind of data
-    var_name: str  # used for all kind of data
-    style: str
-    delete_after_days: int
-    delete_after_count: int
+    var_name: Optional[str]  # used for all kind of data
+    style: Optional[str]
+    delete_after_days: Optional[int]
+    delete_after_count: Optional[int]
     format: str
-    time_dimension: bool
-    time_attribute: str
-    parameters: str
+    time_dimension: Optional[bool]
+    time_attribute: Optional[str]
+    parameters: Optional[str]
@@ -1,9 +1,14 @@
 import base64
 import datetime
+import hashlib
 import io
 import json
 import logging
-from typing import Optional
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
 
 import requests
 from requests.models import HTTPError
@@ -13,6 +18,10 @@ from importer.settings.instance import settings
 LOG = logging.getLogger(__name__)
 
 
+class ResourceNotModified(Exception):
+    """Raised when the Data Lake confirms that a resource did not change since the last download"""
+
+
 class DataLakeDriver:
     """Driver that manages the authentication with the Data Lake using oauth"""
 
@@ -46,15 +55,26 @@ class DataLakeDriver:
         if self.access_token is None or datetime.datetime.utcnow() > self.access_token_expiration:
             self.access_token, _, self.access_token_expiration = self.get_access_token(project_name)
 
-    def get(self, project_name, resource_id: str, resource_url: Optional[str]):
+    def get(
+        self,
+        project_name,
+        resource_id: str,
+        resource_url: Optional[str],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ):
+        """Request a resource from the Data Lake, returning the streamed response and its url.
+        When the validators of a previous download are given, the request is conditional and
+        ResourceNotModified is raised if the resource did not change.
+        """
         self.set_access_token(project_name)
         try:
-            return self.get_implement(resource_id, resource_url)
+            return self.get_implement(resource_id, resource_url, etag, last_modified)
         except HTTPError:
             self.access_token, _, self.access_token_expiration = self.get_access_token(project_name)
-            return self.get_implement(resource_id, resource_url)
+            return self.get_implement(resource_id, resource_url, etag, last_modified)
 
-    def get_implement(self, resource_id, resource_url):
+    def get_implement(self, resource_id, resource_url, etag=None, last_modified=None):
         if resource_url is None:  # if resource_url is not provided, retrieve it from data lake using the resource_id
             response = requests.get(
                 settings.data_lake_resource_show_url(),
@@ -67,7 +87,128 @@ class DataLakeDriver:
                 resource_url = resp_as_dict["result"]["url"]
                 LOG.debug(f"Data Lake resource with id {resource_id} obtained")
         LOG.info(f"Downloading resource from {resource_url}")
-        return requests.get(resource_url, headers=settings.data_lake_headers(self.access_token)), resource_url
+        headers = settings.data_lake_headers(self.access_token)
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        response = requests.get(resource_url, headers=headers, stream=True)
+        if response.status_code == 304:
+            response.close()
+            raise ResourceNotModified(f"Resource {resource_id} not modified since last download")
+        return response, resource_url
+
+    @staticmethod
+    def get_validators(response) -> Tuple[Optional[str], Optional[str]]:
+        """Return the (ETag, Last-Modified) headers of a response, used to make later requests conditional"""
+        return response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+    @staticmethod
+    def accepts_ranges(response) -> bool:
+        return response.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+    def get_resource_hash(self, resource_id: str) -> Optional[str]:
+        """Retrieve the checksum declared on the Data Lake for a resource, if any"""
+        response = requests.get(
+            settings.data_lake_resource_show_url(),
+            params={"id": resource_id},
+            headers=settings.data_lake_headers(self.access_token),
+        )
+        if response.status_code // 100 != 2:
+            return None
+        return response.json()["result"].get("hash") or None
+
+    @staticmethod
+    def parse_hash(declared_hash: str) -> Tuple[str, str]:
+        """Split a declared checksum into (algorithm, hex digest).
+        Both "<algorithm>:<digest>" and bare digests are accepted, the latter recognized by their length.
+        """
+        if ":" in declared_hash:
+            algorithm, digest = declared_hash.split(":", 1)
+            return algorithm.lower(), digest.lower()
+        algorithm = {32: "md5", 40: "sha1", 64: "sha256", 128: "sha512"}.get(len(declared_hash))
+        return algorithm, declared_hash.lower()
+
+    def download_ranged(
+        self, project_name: str, resource_id: str, resource_url: str, path: str, size: int, content_hash=None
+    ) -> str:
+        """Download a resource to path using several parallel HTTP Range requests.
+        Each segment is written to its own part file: an interrupted segment is retried within this call,
+        resuming from the bytes already received. The parts are not kept across calls, a failed download
+        starts over. Parts are then joined, checking the final size and the checksum declared on the
+        Data Lake, if any.
+        :param resource_url: url of the resource, whose server must accept byte ranges
+        :param path: destination file
+        :param size: total size of the resource in bytes
+        :param content_hash: optional hashlib object updated with the content while joining the parts
+        """
+        segments = max(1, min(settings.download_segments, math.ceil(size / settings.download_min_segment_size)))
+        bounds = [(i * size // segments, (i + 1) * size // segments - 1) for i in range(segments)]
+        parts = [f"{path}.part{i}" for i in range(segments)]
+        LOG.info(f"Downloading {size} bytes from {resource_url} in {segments} segments")
+
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            futures = [
+                executor.submit(self.download_segment, project_name, resource_url, part, start, end)
+                for part, (start, end) in zip(parts, bounds)
+            ]
+            for future in futures:
+                future.result()
+
+        declared_hash = self.get_resource_hash(resource_id) if resource_id else None
+        algorithm, expected_digest = self.parse_hash(declared_hash) if declared_hash else (None, None)
+        try:
+            digest = hashlib.new(algorithm) if algorithm else None
+        except ValueError:
+            LOG.warning(f"Unsupported checksum {declared_hash} for resource {resource_id}, skipping verification")
+            digest = None
+
+        with open(path, "wb") as f:
+            for part in parts:
+                with open(part, "rb") as p:
+                    while True:
+                        chunk = p.read(settings.download_chunk_size)
+                        if not chunk:
+                            break
+                        if digest:
+                            digest.update(chunk)
+                        if content_hash:
+                            content_hash.update(chunk)
+                        f.write(chunk)
+                os.remove(part)
+
+        downloaded = os.path.getsize(path)
+        if downloaded != size:
+            raise OSError(f"Downloaded {downloaded} bytes from {resource_url}, expected {size}")
+        if digest and digest.hexdigest() != expected_digest:
+            raise OSError(f"Checksum mismatch for {resource_url}: {digest.hexdigest()} != {expected_digest}")
+        return path
+
+    def download_segment(self, project_name: str, resource_url: str, part: str, start: int, end: int):
+        """Download the bytes [start, end] of a resource into the part file, resuming it on each retry"""
+        length = end - start + 1
+        for attempt in range(settings.download_retries + 1):
+            received = os.path.getsize(part) if os.path.exists(part) else 0
+            if received >= length:
+                return
+            try:
+                self.set_access_token(project_name)
+                headers = settings.data_lake_headers(self.access_token)
+                headers["Range"] = f"bytes={start + received}-{end}"
+                with requests.get(resource_url, headers=headers, stream=True) as r:
+                    r.raise_for_status()
+                    if r.status_code != 206:
+                        raise OSError(f"Range request not honoured by {resource_url}: {r.status_code}")
+                    with open(part, "ab") as f:
+                        for chunk in r.iter_content(chunk_size=settings.download_chunk_size):
+                            f.write(chunk)
+            except (requests.RequestException, OSError) as e:
+                if attempt == settings.download_retries:
+                    raise
+                LOG.warning(f"Segment {start}-{end} of {resource_url} interrupted, resuming: {e}")
+                time.sleep(2**attempt)
+        if os.path.getsize(part) < length:
+            raise OSError(f"Segment {start}-{end} of {resource_url} incomplete")
 
     def get_metadata(self, organization: str, metadata_id: str, include_private=True):
         """Retrieve from the datalake the metadata assosiated with a given metadata_id
@@ -1,16 +1,19 @@
 import asyncio
+import glob
 import io
 import logging
 import os
+import threading
 from datetime import datetime
 from itertools import chain
-from typing import List
+from typing import Dict, List, Optional, Set
 
 import aiohttp
 import pandas as pd
 import requests
 
 from importer.driver.geoserverrest import GeoserverREST
+from importer.dto.layer_deletion import LayerDeletion
 from importer.dto.layer_publication_status import LayerPublicationStatus
 from importer.manager.data_storage_manager import DataStorageManager
 from importer.settings.instance import settings
@@ -26,23 +29,73 @@ class GeoserverDriver:
             service_url=self.service_url,
             username=settings.geoserver_admin_user,
             password=settings.geoserver_admin_password,
+            max_concurrency=settings.geoserver_max_concurrency,
         )
         self.dsm = DataStorageManager()
+        # known workspaces, each one with its datastores
+        self._catalog: Dict[str, Set[str]] = {}
+        self._catalog_loaded = False
+        self._catalog_lock = threading.Lock()
+
+    def load_catalog(self):
+        """Seeds the catalog cache with the existing workspaces and datastores, so that publishing goes straight
+        to the create/publish calls"""
+        try:
+            r = self.geoserver.session.get(f"{self.service_url}/rest/workspaces.json")
+            r.raise_for_status()
+            workspaces = r.json()["workspaces"] or {}
+            catalog = {}
+            for workspace in workspaces.get("workspace", []):
+                catalog[workspace["name"]] = self.__get_datastore_names(workspace["name"])
+        except Exception as e:
+            LOG.error(f"GeoServer catalog can not be loaded, checking it on demand: {e}")
+            return
+        with self._catalog_lock:
+            self._catalog = catalog
+            self._catalog_loaded = True
+        LOG.info(f"GeoServer catalog loaded: {sum(len(stores) for stores in catalog.values())} datastores")
+
+    def invalidate_catalog(self, workspace: str = None, store_name: str = None):
+        """Forgets a datastore, a workspace or (without arguments) the whole catalog cache"""
+        with self._catalog_lock:
+            if workspace is None:
+                self._catalog = {}
+                self._catalog_loaded = False
+            elif store_name is None:
+                self._catalog.pop(workspace, None)
+                self._catalog_loaded = False
+            elif workspace in self._catalog:
+                self._catalog[workspace].discard(store_name)
+
+    def __get_datastore_names(self, workspace: str) -> Set[str]:
+        existing_datastore = self.geoserver.get_datastores(workspace=workspace)
+        if existing_datastore["dataStores"] == "":
+            return set()
+        return set(dsitem["name"] for dsitem in existing_datastore["dataStores"]["dataStore"])
 
     def create_workspace(self, workspace: str):
-        existing_workspace = self.geoserver.get_workspace(workspace)
+        with self._catalog_lock:
+            if workspace in self._catalog:
+                return
+            catalog_loaded = self._catalog_loaded
+        # with a loaded catalog an unknown workspace is missing, otherwise ask GeoServer
+        existing_workspace = None if catalog_loaded else self.geoserver.get_workspace(workspace)
         if not existing_workspace:
             LOG.info(f"Creating workspace {workspace}")
             result = self.geoserver.create_workspace(workspace=workspace)
             if result:
                 LOG.info(result)
+        with self._catalog_lock:
+            self._catalog.setdefault(workspace, set())
 
     def create_store(self, store_name: str, workspace: str):
-        existing_datastore = self.geoserver.get_datastores(workspace=workspace)
-        LOG.info(f'existing_datastore: {existing_datastore}')
-        if existing_datastore["dataStores"] == "" or (
-            store_name not in [dsitem["name"] for dsitem in existing_datastore["dataStores"]["dataStore"]]
-        ):
+        with self._catalog_lock:
+            if store_name in self._catalog.get(workspace, set()):
+                return
+            catalog_loaded = self._catalog_loaded
+        existing_datastores = set() if catalog_loaded else self.__get_datastore_names(workspace)
+        LOG.info(f"existing_datastore: {existing_datastores}")
+        if store_name not in existing_datastores:
             LOG.info(f"Creating store {store_name} for workspace {workspace}")
             result = self.geoserver.create_featurestore(
                 workspace=workspace,
@@ -54,8 +107,24 @@ class GeoserverDriver:
             )
             if result:
                 LOG.error(result)
+        with self._catalog_lock:
+            self._catalog.setdefault(workspace, set()).add(store_name)
 
-    def publish_table(self, workspace: str, store_name: str, layer_name: str, layer_title: str, datatype: str, start_time: datetime):
+    @staticmethod
+    def is_not_found(error) -> bool:
+        """Whether a GeoServer error (exception or "<status>: <message>" string) is a 404"""
+        return getattr(error, "status", None) == 404 or str(error).startswith("404")
+
+    def publish_table(
+        self,
+        workspace: str,
+        store_name: str,
+        layer_name: str,
+        layer_title: str,
+        datatype: str,
+        start_time: datetime,
+        timestamps: List[str] = None,
+    ):
         """
         Publishes a layer from a table in the geoserver.
 
@@ -65,11 +134,14 @@ class GeoserverDriver:
             layer_name (str): The name of the layer.
             datatype (str): The datatype of the layer.
             start_time (datetime): The start time.
+            timestamps (List[str], optional): The timestamps of a time-enabled layer, computed while loading it.
+                If missing, they are queried from the table.
 
         Returns:
             LayerPublicationStatus: An object representing the status of the layer publication.
         """
         LOG.info(f"Publishing layer {layer_name} from table")
+        vector_timestamps = timestamps
         timestamps = [isoformat_Z(set_utc_default_tz(start_time))]
         try:
             self.geoserver.publish_featurestore(workspace=workspace, store_name=store_name, pg_table=layer_name)
@@ -79,7 +151,7 @@ class GeoserverDriver:
             if self.dsm.has_time_dimension(workspace, datatype):
                 time_attribute = self.dsm.get_time_attribute(workspace, datatype)
                 err_status = self.geoserver.publish_vector_time_dimensions(workspace, layer_name, layer_title, time_attribute)
-                ts = self.dsm.get_timestamps_from_vector(layer_name, time_attribute)
+                ts = vector_timestamps or self.dsm.get_timestamps_from_vector(layer_name, time_attribute)
                 if ts:
                     timestamps = ts
                 if not err_status:
@@ -87,6 +159,9 @@ class GeoserverDriver:
         except Exception as e:
             err_status = str(e)
             LOG.error(e)
+            if self.is_not_found(e):
+                # the workspace or the store have been removed behind our back
+                self.invalidate_catalog(workspace, store_name)
         return LayerPublicationStatus(
             is_container=False,
             original_name=layer_name,
@@ -109,11 +184,18 @@ class GeoserverDriver:
                 LOG.error(e)
 
     def publish_from_db(
-        self, workspace: str, store_name: str, layer_name: str, layer_title: str, datatype: str, start_time: datetime
+        self,
+        workspace: str,
+        store_name: str,
+        layer_name: str,
+        layer_title: str,
+        datatype: str,
+        start_time: datetime,
+        timestamps: List[str] = None,
     ) -> List[LayerPublicationStatus]:
         self.create_workspace(workspace)
         self.create_store(store_name, workspace)
-        res = self.publish_table(workspace, store_name, layer_name, layer_title, datatype, start_time)
+        res = self.publish_table(workspace, store_name, layer_name, layer_title, datatype, start_time, timestamps)
         if res.success:
             self.style_layer(workspace, res.layer_name, res.datatype)
         return [res]
@@ -143,18 +225,70 @@ class GeoserverDriver:
                 LOG.info(f"Layer {res.layer_name} successfully published from location!")
             else:
                 LOG.error(res.exception)
+                if self.is_not_found(res.exception):
+                    self.invalidate_catalog(workspace)
 
         return result
 
-    def delete_layer(self, workspace: str, layer_name: str, store_name: str, is_coveragestore: bool):
-        LOG.info(f"Deleting layer {workspace}:{layer_name}")
-        result = self.geoserver.delete_layer(workspace=workspace, layer_name=layer_name)
+    def publish_granules(
+        self,
+        workspace: str,
+        layer_name: str,
+        storage_location: str,
+        resource_id: str,
+        datatype: str,
+        start_time: datetime,
+    ) -> List[LayerPublicationStatus]:
+        """Adds the files of a resource to the time-enabled mosaic of its datatype"""
+        self.create_workspace(workspace)
+        params = self.dsm.get_parameters(workspace, datatype)
+        granules = sorted(glob.glob(f"{glob.escape(os.path.join(storage_location, f'{datatype}_{resource_id}_'))}*"))
+        LOG.info(f"Harvesting granules {granules} into mosaic {layer_name}")
+        result = self.geoserver.harvest_granules(
+            workspace=workspace,
+            coveragestore_name=layer_name,
+            mosaic_path=storage_location,
+            granules=granules,
+            datatype=datatype,
+            start_time=start_time,
+            params=params,
+        )
+        for res in result:
+            if res.success:
+                self.style_layer(workspace, res.layer_name, res.datatype)
+                LOG.info(f"Granules of {resource_id} successfully harvested into mosaic {res.layer_name}!")
+            else:
+                LOG.error(res.exception)
+                if self.is_not_found(res.exception):
+                    self.invalidate_catalog(workspace)
+        return result
+
+    def update_layer_title(self, workspace: str, layer_name: str, title: str, is_netcdf: bool = False):
+        LOG.info(f"Updating title of layer {workspace}:{layer_name}")
+        result = self.geoserver.update_layer_title(workspace, layer_name, title, prefix_native_name=is_netcdf)
         if result:
-            LOG.info(result)
-        if is_coveragestore:
-            result = self.geoserver.delete_coveragestore(workspace=workspace, coveragestore_name=store_name)
-            if result:
-                LOG.error(result)
+            LOG.error(result)
+
+    def delete_layers(self, deletions: List[LayerDeletion]) -> List[LayerDeletion]:
+        """Runs the deletions concurrently, at most geoserver_max_concurrency requests at a time,
+        and records the outcome of each one in its exception"""
+        for deletion, exception in zip(deletions, self.geoserver.executor.map(self.__delete, deletions)):
+            deletion.exception = exception
+            if exception:
+                LOG.error(f"Deleting {deletion} failed: {exception}")
+            elif deletion.kind == LayerDeletion.COVERAGESTORE:
+                self.invalidate_catalog(deletion.workspace, deletion.name)
+        return deletions
+
+    def __delete(self, deletion: LayerDeletion) -> Optional[str]:
+        if deletion.kind == LayerDeletion.GRANULES:
+            LOG.info(f"Deleting granules {deletion.location_prefix}* from mosaic {deletion.workspace}:{deletion.name}")
+            return self.geoserver.delete_granules(deletion.workspace, deletion.name, deletion.location_prefix)
+        if deletion.kind == LayerDeletion.COVERAGESTORE:
+            LOG.info(f"Deleting coverage store {deletion.workspace}:{deletion.name} with its layers")
+            return self.geoserver.delete_coveragestore_recurse(deletion.workspace, deletion.name)
+        LOG.info(f"Deleting layer {deletion.workspace}:{deletion.name}")
+        return self.geoserver.delete_layer_recurse(deletion.workspace, deletion.name)
 
     async def get_feature_info(self, session, url, params):
         """
@@ -1,31 +1,58 @@
 import json
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import reduce
 from typing import List, Optional
 import pathlib
-import numpy
 import requests
-import xarray
+import requests.adapters
 from geo.Geoserver import Geoserver
 
 from importer.dto.layer_publication_status import LayerPublicationStatus
 from importer.util.datetimeutils import isoformat_Z, set_utc_default_tz
+from importer.util.netcdfutils import read_time_axis
 
 LOG = logging.getLogger(__name__)
 
 
+class BoundedSession(requests.Session):
+    """Session limiting the number of requests in flight, shared by the threads publishing on the same GeoServer"""
+
+    def __init__(self, max_concurrency: int):
+        super().__init__()
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(1, max_concurrency))
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, *args, **kwargs):
+        with self._semaphore:
+            return super().request(*args, **kwargs)
+
+
 class GeoserverREST(Geoserver):
-    def __init__(self, *args, **kwargs) -> None:
+    def __init__(self, *args, max_concurrency: int = 8, **kwargs) -> None:
+        """
+        :param max_concurrency: maximum number of concurrent REST requests sent by this client
+        """
         super().__init__(*args, **kwargs)
-        self._session = requests.Session()
+        self._session = BoundedSession(max_concurrency)
         self._session.auth = (self.username, self.password)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="geoserver")
+        self._mosaic_locks = {}
+        self._mosaic_locks_guard = threading.Lock()
 
     @property
     def session(self):
         return self._session
 
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        return self._executor
+
     def __featuretype_withtime(self, workspace: str, featuretype: str, title:str, time_attribute: str):
         url = f"{self.service_url}/rest/workspaces/{workspace}/featuretypes/{featuretype}.json"
         data = {
@@ -209,10 +236,7 @@ class GeoserverREST(Geoserver):
             r = self.session.post(url, json=data)
             if r.status_code == 201:
                 err_string = None
-                timestamps = [
-                    numpy.datetime_as_string(t, unit="ms", timezone="UTC")
-                    for t in xarray.open_dataset(path).load().time.data
-                ]
+                timestamps = read_time_axis(path)
             else:
                 err_string = f"{r.status_code}: The coveragestore can not be created! {r.text}"
         except Exception as e:
@@ -225,56 +249,65 @@ class GeoserverREST(Geoserver):
         if err_string is not None:
             return publication_statuses
 
-        for pairmap in netcdf_dt_rewrite:
-            if len(pairmap["native"].split(",")) > 1:
-                # not used anymore
-                url, data, coveragename = self.__packcoverageview(
-                    workspace,
-                    coveragestore_name,
-                    coveragestore_title,
-                    pairmap["native"],
-                    pairmap["rename"],
-                    withtime=pairmap["time_dimension"],
-                )
-            else:
-                url, data, coveragename = self.__packcoverage(
-                    workspace,
-                    coveragestore_name,
-                    coveragestore_title,
-                    pairmap["native"],
-                    pairmap["rename"],
-                    withtime=pairmap["time_dimension"],
-                )
-            try:
-                r = self.session.post(url, json=data)
-                if r.status_code == 201:
-                    err_string = None
-                else:
-                    err_string = f"{r.status_code}: The coveragestore can not be created! {r.text}"
-            except Exception as e:
-                err_string = f"Error: {e}"
-            publication_statuses.append(
-                LayerPublicationStatus(
-                    False, coveragestore_name, coveragename, err_string, pairmap["rename"], timestamps
-                )
+        # the coverages of the variables are independent, publish them concurrently keeping their order
+        publication_statuses.extend(
+            self._executor.map(
+                lambda pairmap: self.__publish_netcdf_coverage(
+                    workspace, coveragestore_name, coveragestore_title, pairmap, timestamps
+                ),
+                netcdf_dt_rewrite or [],
             )
-
-            # update gwc layer with time
-            url, data = self.__create_gwc_layer_withtime(workspace, coveragename)
-            try:
-                r = self.session.post(url, json=data)
-                if r.status_code / 100 == 2:
-                    err_string = None
-                else:
-                    err_string = (
-                        f"{r.status_code}: The gwc layer can not be updated with TIME parameter! {r.text}, "
-                        f"url: {url}, data: {data}"
-                    )
-            except Exception as e:
-                err_string = f"Error: {e}"
+        )
 
         return publication_statuses
 
+    def __publish_netcdf_coverage(
+        self, workspace: str, coveragestore_name: str, coveragestore_title: str, pairmap: dict, timestamps: List[str]
+    ) -> LayerPublicationStatus:
+        if len(pairmap["native"].split(",")) > 1:
+            # not used anymore
+            url, data, coveragename = self.__packcoverageview(
+                workspace,
+                coveragestore_name,
+                coveragestore_title,
+                pairmap["native"],
+                pairmap["rename"],
+                withtime=pairmap["time_dimension"],
+            )
+        else:
+            url, data, coveragename = self.__packcoverage(
+                workspace,
+                coveragestore_name,
+                coveragestore_title,
+                pairmap["native"],
+                pairmap["rename"],
+                withtime=pairmap["time_dimension"],
+            )
+        try:
+            r = self.session.post(url, json=data)
+            if r.status_code == 201:
+                err_string = None
+            else:
+                err_string = f"{r.status_code}: The coveragestore can not be created! {r.text}"
+        except Exception as e:
+            err_string = f"Error: {e}"
+        publication_status = LayerPublicationStatus(
+            False, coveragestore_name, coveragename, err_string, pairmap["rename"], timestamps
+        )
+
+        # update gwc layer with time
+        url, data = self.__create_gwc_layer_withtime(workspace, coveragename)
+        try:
+            r = self.session.post(url, json=data)
+            if r.status_code // 100 != 2:
+                LOG.warning(
+                    f"{r.status_code}: The gwc layer can not be updated with TIME parameter! {r.text}, "
+                    f"url: {url}, data: {data}"
+                )
+        except Exception as e:
+            LOG.warning(f"Error: {e}")
+        return publication_status
+
     def __create_coveragestore_common(
         self,
         path: str,
@@ -403,6 +436,137 @@ class GeoserverREST(Geoserver):
 
         return publication_statuses
 
+    def harvest_granules(
+        self,
+        workspace: str,
+        coveragestore_name: str,
+        mosaic_path: str,
+        granules: List[str],
+        datatype: str,
+        start_time: datetime,
+        params: dict = None,
+    ) -> List[LayerPublicationStatus]:
+        """
+        Adds granules to the time-enabled ImageMosaic of a datatype, whose index lives in PostGIS.
+        The first call creates the store from the mosaic folder (harvesting the granules already there),
+        configures its coverage and enables the time dimension; later calls harvest the new files only.
+        """
+        store_url = f"{self.service_url}/rest/workspaces/{workspace}/coveragestores/{coveragestore_name}"
+        headers = {"Content-type": "text/plain"}
+        err_string = None
+        with self.__mosaic_lock(workspace, coveragestore_name):
+            try:
+                r = self.session.get(f"{store_url}.json")
+                if r.status_code == 404:
+                    r = self.session.put(
+                        f"{store_url}/external.imagemosaic",
+                        data=f"file:{mosaic_path}",
+                        headers=headers,
+                        params={"configure": "first", "coverageName": coveragestore_name},
+                    )
+                    if r.status_code not in (200, 201):
+                        err_string = f"{r.status_code}: The mosaic can not be created! {r.text}"
+                    else:
+                        err_string = self.__enable_mosaic_time(workspace, coveragestore_name)
+                        self.__apply_params(workspace, coveragestore_name, params)
+                elif r.status_code == 200:
+                    for granule in granules:
+                        r = self.session.post(
+                            f"{store_url}/external.imagemosaic", data=f"file:{granule}", headers=headers
+                        )
+                        if r.status_code not in (200, 201, 202):
+                            err_string = f"{r.status_code}: The granule {granule} can not be harvested! {r.text}"
+                            break
+                else:
+                    err_string = f"{r.status_code}: The mosaic can not be found! {r.text}"
+            except Exception as e:
+                err_string = f"Error: {e}"
+
+        return [
+            LayerPublicationStatus(
+                is_container=False,
+                original_name=coveragestore_name,
+                layer_name=coveragestore_name,
+                exception=err_string,
+                datatype=datatype,
+                timestamps=([] if err_string else [isoformat_Z(set_utc_default_tz(start_time))]),
+            )
+        ]
+
+    def delete_granules(self, workspace: str, coveragestore_name: str, location_prefix: str) -> Optional[str]:
+        """Removes from the index of an ImageMosaic the granules whose location starts with the given prefix"""
+        url = (
+            f"{self.service_url}/rest/workspaces/{workspace}/coveragestores/{coveragestore_name}/"
+            f"coverages/{coveragestore_name}/index/granules"
+        )
+        # the prefix is matched literally: the LIKE wildcards (and "_" is common in layer names) are escaped
+        # with the escape character of GeoTools, then quotes are doubled for the CQL string literal
+        escaped_prefix = "".join(f"\\{c}" if c in "\\%_" else c for c in location_prefix).replace("'", "''")
+        try:
+            r = self.session.delete(url, params={"filter": f"location LIKE '{escaped_prefix}%'"})
+            if r.status_code != 200:
+                return f"{r.status_code}: The granules can not be deleted! {r.text}"
+        except Exception as e:
+            return f"Error: {e}"
+        return None
+
+    def delete_layer_recurse(self, workspace: str, layer_name: str) -> Optional[str]:
+        """Deletes a layer together with its resource (feature type or coverage), a missing one is not an error"""
+        url = f"{self.service_url}/rest/workspaces/{workspace}/layers/{layer_name}"
+        return self.__delete_recurse(url, f"layer {workspace}:{layer_name}")
+
+    def delete_coveragestore_recurse(self, workspace: str, coveragestore_name: str) -> Optional[str]:
+        """Deletes a coverage store with all its coverages and layers in one request, a missing one is not an error"""
+        url = f"{self.service_url}/rest/workspaces/{workspace}/coveragestores/{coveragestore_name}"
+        return self.__delete_recurse(url, f"coverage store {workspace}:{coveragestore_name}")
+
+    def __delete_recurse(self, url: str, description: str) -> Optional[str]:
+        try:
+            r = self.session.delete(url, params={"recurse": "true"})
+            if r.status_code == 404:
+                LOG.debug(f"The {description} does not exist anymore")
+            elif r.status_code != 200:
+                return f"{r.status_code}: The {description} can not be deleted! {r.text}"
+        except Exception as e:
+            return f"Error: {e}"
+        return None
+
+    def __enable_mosaic_time(self, workspace: str, coveragestore_name: str) -> Optional[str]:
+        url = (
+            f"{self.service_url}/rest/workspaces/{workspace}/coveragestores/{coveragestore_name}/"
+            f"coverages/{coveragestore_name}.json"
+        )
+        data = {
+            "coverage": {
+                "enabled": True,
+                "metadata": {
+                    "entry": [
+                        {
+                            "@key": "time",
+                            "dimensionInfo": {
+                                "enabled": True,
+                                "presentation": "LIST",
+                                "units": "ISO8601",
+                                "defaultValue": {"strategy": "MAXIMUM"},
+                            },
+                        }
+                    ]
+                },
+            }
+        }
+        try:
+            r = self.session.put(url, json=data)
+            if r.status_code != 200:
+                return f"{r.status_code}: The TIME dimension can not be enabled! {r.text}"
+        except Exception as e:
+            return f"Error: {e}"
+        return None
+
+    def __mosaic_lock(self, workspace: str, coveragestore_name: str) -> threading.Lock:
+        # granules of the same mosaic may be published concurrently, only one must create the store
+        with self._mosaic_locks_guard:
+            return self._mosaic_locks.setdefault((workspace, coveragestore_name), threading.Lock())
+
     def create_coveragestore_patched(
         self,
         path: str,
@@ -496,6 +660,32 @@ class GeoserverREST(Geoserver):
 
         return status
 
+    def update_layer_title(self, workspace: str, layer_name: str, title: str, prefix_native_name: bool = False):
+        """
+        Updates the title of the resource (coverage or featuretype) behind a layer.
+        With prefix_native_name the native coverage name is prepended, as done when publishing NetCDF variables.
+        """
+        url = f"{self.service_url}/rest/layers/{workspace}:{layer_name}.json"
+        try:
+            r = self.session.get(url)
+            if r.status_code != 200:
+                return f"{r.status_code}: The layer can not be found! {r.text}"
+            resource = r.json()["layer"]["resource"]
+            resource_class, resource_url = resource["@class"], resource["href"]
+            if prefix_native_name:
+                r = self.session.get(resource_url)
+                if r.status_code != 200:
+                    return f"{r.status_code}: The resource can not be found! {r.text}"
+                native_name = r.json()[resource_class].get("nativeCoverageName")
+                if native_name:
+                    title = f"{native_name} {title}"
+            r = self.session.put(resource_url, json={resource_class: {"title": title}})
+            if r.status_code != 200:
+                return f"{r.status_code}: The title can not be updated! {r.text}"
+        except Exception as e:
+            return f"Error: {e}"
+        return None
+
     def __apply_params(self, workspace: str, coveragestore_name: str, params: dict = None):
         if params is None:
             return None
@@ -1,12 +1,17 @@
 import logging
+import uuid
 from typing import List
 
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
 from pandas.io import sql
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 from importer.settings.instance import settings
+from importer.util.pgcopyutils import copy_options, to_copy_csv
 
 LOG = logging.getLogger(__name__)
 
@@ -18,7 +23,71 @@ class PostGISDriver:
         self.SessionLocal = scoped_session(session_factory)
 
     def save_table(self, gpd_df: gpd.GeoDataFrame, table_name: str):
-        gpd_df.to_postgis(table_name, self.engine, if_exists="replace", index=True, index_label="Index")
+        """
+        Loads the dataframe into a staging table with COPY, indexes and analyzes it, then swaps it with the
+        live table (if any) in the same transaction, so that the layer is never missing during reloads.
+        :param gpd_df:     features to load, the index is saved in the "Index" column
+        :param table_name: name of the live table
+        """
+        geom_col = gpd_df.geometry.name
+        srid = gpd_df.crs.to_epsg() if gpd_df.crs else None
+        srid = srid or 0
+        df = pd.DataFrame(gpd_df.drop(columns=geom_col))
+        df.index.name = "Index"
+        df = df.reset_index()
+        geometries = np.asarray(gpd_df.geometry.values, dtype=object)
+        df[geom_col] = shapely.to_wkb(shapely.set_srid(geometries, srid), hex=True, include_srid=True)
+
+        suffix = uuid.uuid4().hex
+        staging_name, old_name = f"staging_{suffix}", f"old_{suffix}"
+        columns = ", ".join(f'"{column}" {self.__column_type(df[column])}' for column in df.columns[:-1])
+        columns += f', "{geom_col}" geometry({self.__geometry_type(gpd_df.geometry)}, {srid})'
+        quoted_columns = [f'"{column}"' for column in df.columns]
+        column_names = ", ".join(quoted_columns)
+        options = copy_options(quoted_columns)
+
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'CREATE TABLE "{staging_name}" ({columns})')
+                copy_statement = f'COPY "{staging_name}" ({column_names}) FROM STDIN WITH ({options})'
+                for start in range(0, len(df), settings.postgis_copy_batch_size):
+                    buffer = to_copy_csv(df.iloc[start : start + settings.postgis_copy_batch_size])
+                    cursor.copy_expert(copy_statement, buffer)
+                cursor.execute(f'CREATE INDEX "ix_{suffix}_Index" ON "{staging_name}" ("Index")')
+                cursor.execute(f'CREATE INDEX "idx_{suffix}_{geom_col}" ON "{staging_name}" USING GIST ("{geom_col}")')
+                cursor.execute(f'ANALYZE "{staging_name}"')
+                cursor.execute(f'ALTER TABLE IF EXISTS "{table_name}" RENAME TO "{old_name}"')
+                cursor.execute(f'ALTER TABLE "{staging_name}" RENAME TO "{table_name}"')
+                cursor.execute(f'DROP TABLE IF EXISTS "{old_name}"')
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+        LOG.info(f"{len(df)} features loaded in table {table_name}")
+
+    @staticmethod
+    def __column_type(column: pd.Series) -> str:
+        if pd.api.types.is_bool_dtype(column):
+            return "boolean"
+        if pd.api.types.is_integer_dtype(column):
+            return "bigint"
+        if pd.api.types.is_float_dtype(column):
+            return "double precision"
+        if isinstance(column.dtype, pd.DatetimeTZDtype):
+            return "timestamp with time zone"
+        if pd.api.types.is_datetime64_dtype(column):
+            return "timestamp without time zone"
+        return "text"
+
+    @staticmethod
+    def __geometry_type(geometry: gpd.GeoSeries) -> str:
+        geom_types = geometry.geom_type.dropna().replace("LinearRing", "LineString").unique()
+        if len(geom_types) != 1:
+            return "Geometry"
+        return f"{geom_types[0]}Z" if geometry.has_z.any() else geom_types[0]
 
     def get_table(self, table_name: str, geom_col: str = "geometry"):
         sql_script = f'SELECT * FROM "{table_name}"'
@@ -27,6 +96,10 @@ class PostGISDriver:
         except Exception:
             return gpd.GeoDataFrame.from_postgis(sql_script, self.engine, geom_col="geom")
 
+    def get_distinct_values(self, table_name: str, column: str) -> pd.Series:
+        sql_script = f'SELECT DISTINCT "{column}" FROM "{table_name}" WHERE "{column}" IS NOT NULL'
+        return pd.read_sql(sql_script, self.engine)[column]
+
     def get_table_value(
         self,
         table_names: List[str],
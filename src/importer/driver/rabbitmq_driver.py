@@ -4,11 +4,14 @@ import ssl
 import time
 import os
 from enum import Enum
+from functools import partial
 from socket import gaierror
 
 import pika
 from pika.exceptions import StreamLostError
 
+from importer.util.workerpool import KeyedWorkerPool
+
 LOG = logging.getLogger(__name__)
 
 
@@ -231,14 +234,27 @@ class Consumer:
         callback,
         schema=json,
         prefetch=1,
-        ack_every=1,
         passive=True,
         use_ssl=True,
+        workers=1,
+        key_func=None,
+        heartbeat=None,
+        coalesce_window=0,
+        merge_func=None,
     ):
         """Create a new instance of the consumer class, passing in the AMQP URL used to connect to RabbitMQ.
+        Messages are processed by worker threads, so that the ioloop keeps servicing heartbeats
+        while long imports are running.
         :param str amqp_url: The AMQP url to connect with
         :param fun callback: function to call on message received
         :param int prefetch: number of messages to prefetch
+        :param int workers: number of worker threads processing messages
+        :param fun key_func: function returning the ordering key of a decoded message, messages sharing
+            the same key are processed sequentially in delivery order
+        :param int heartbeat: AMQP heartbeat timeout in seconds, None to accept the broker proposal
+        :param float coalesce_window: seconds a message waits for later ones with the same key, 0 to disable
+        :param fun merge_func: function merging a pending message with a later one sharing its key,
+            returning the message to process. All the merged deliveries are acked together
         """
         self.host = host
         self.ca_cert_file = ca_cert_file
@@ -254,6 +270,7 @@ class Consumer:
                 port=port,
                 virtual_host=vhost,
                 ssl_options=ssl_options,
+                heartbeat=heartbeat,
             )
         
         self._callback = callback
@@ -274,10 +291,14 @@ class Consumer:
         # for higher consumer throughput
         self._prefetch_count = prefetch
         self._passive = passive
-        self._ack_every = ack_every
-        self._received = 0
         self._ready = False
-        
+        self._key_func = key_func
+        self._pool = KeyedWorkerPool(workers, name="consumer")
+        self._coalesce_window = coalesce_window if key_func and merge_func else 0
+        self._merge_func = merge_func
+        # messages waiting for the coalescing window to expire, by key
+        self._pending = {}
+
     def __get_tls_parameters(self):
         context = ssl.create_default_context(cafile=self.ca_cert_file)
         context.verify_mode = ssl.CERT_REQUIRED
@@ -304,9 +325,8 @@ class Consumer:
         self.exchange_type = config.get("exchange_type", self.exchange_type)
         self.queue = config.get("queue", self.queue)
         self.routing_key = config.get("routing_key", self.routing_key)
-        # In production, experiment with higher prefetch values
-        # for higher consumer throughput
-        self._received = 0
+        # deliveries of the previous connection will be redelivered
+        self._pending = {}
         self._ready = True
 
     def connect(self):
@@ -463,7 +483,6 @@ class Consumer:
         :param bytes body: The message body
         """
         LOG.debug("Received message # %s from %s", basic_deliver.delivery_tag, properties.app_id)
-        self._received = (self._received + 1) % self._ack_every
         try:
             message = self._schema.loads(body)
             if isinstance(message, dict):
@@ -475,10 +494,93 @@ class Consumer:
             LOG.warning(f"Map Request message is in wrong format - {str(e)}")
             message_as_dict = body
             # raise
-        self._callback(message_as_dict, basic_deliver, properties)
-        if self._received == 0:
-            LOG.debug("Sending ack")
-            self._channel.basic_ack(basic_deliver.delivery_tag, multiple=True)
+        key = self._key_func(message_as_dict) if self._key_func else None
+        if self._coalesce_window > 0 and key is not None:
+            self.coalesce(key, message_as_dict, basic_deliver, properties)
+            return
+        self._pool.submit(key, self._process, self._channel, message_as_dict, [basic_deliver], properties)
+
+    def coalesce(self, key, message, basic_deliver, properties):
+        """Holds a message for the coalescing window, merging it with the pending one sharing its key, if any.
+        :param key: The ordering key of the message
+        :param dict message: The decoded message
+        :param Deliver basic_deliver: The delivery information
+        :param BasicProperties properties: The message properties
+        """
+        pending = self._pending.get(key)
+        if pending is not None:
+            LOG.debug("Coalescing message # %s with pending key %s", basic_deliver.delivery_tag, key)
+            pending["message"] = self._merge_func(pending["message"], message)
+            pending["deliveries"].append(basic_deliver)
+            pending["properties"] = properties
+            return
+        self._pending[key] = {
+            "channel": self._channel,
+            "message": message,
+            "deliveries": [basic_deliver],
+            "properties": properties,
+        }
+        self._connection.ioloop.call_later(self._coalesce_window, partial(self.dispatch_pending, key))
+
+    def dispatch_pending(self, key):
+        """Invoked in the ioloop when the coalescing window of a key expires, hands the merged message to the workers.
+        :param key: The ordering key of the pending message
+        """
+        pending = self._pending.pop(key, None)
+        if pending is None or pending["channel"] is not self._channel:
+            return
+        if len(pending["deliveries"]) > 1:
+            LOG.info("Coalesced %d messages with key %s", len(pending["deliveries"]), key)
+        self._pool.submit(
+            key, self._process, pending["channel"], pending["message"], pending["deliveries"], pending["properties"]
+        )
+
+    def _process(self, channel, message, deliveries, properties):
+        """Runs the callback inside a worker thread, then hands the acks back to the ioloop thread.
+        pika is not thread safe: acks and nacks are never sent from here, but marshalled to the ioloop.
+        Deliveries may complete out of order, so each one is acknowledged on its own.
+        :param pika.channel.Channel channel: The channel the message was delivered on
+        :param dict message: The decoded message
+        :param list deliveries: The delivery information of every message merged into this one
+        :param BasicProperties properties: The message properties
+        """
+        delivery_tags = [basic_deliver.delivery_tag for basic_deliver in deliveries]
+        if channel is not self._channel:
+            # the broker redelivers the messages on the new channel, processing them here would import them twice
+            LOG.warning("Channel reopened before processing messages # %s, skipping them", delivery_tags)
+            return
+        try:
+            self._callback(message, deliveries[-1], properties)
+        except Exception as e:
+            LOG.error(e, exc_info=True)
+            self._threadsafe(partial(self._nack, channel, delivery_tags))
+            return
+        self._threadsafe(partial(self._ack, channel, delivery_tags))
+
+    def _threadsafe(self, callback):
+        """Schedules the callback on the ioloop thread, the only one allowed to use the channel.
+        :param fun callback: function to run in the ioloop
+        """
+        try:
+            self._connection.ioloop.add_callback_threadsafe(callback)
+        except Exception as e:
+            LOG.warning("Cannot reach the ioloop, the message will be redelivered: %s", e)
+
+    def _ack(self, channel, delivery_tags):
+        if channel is not self._channel or not channel.is_open:
+            LOG.warning("Channel closed before ack of messages # %s, they will be redelivered", delivery_tags)
+            return
+        LOG.debug("Sending ack for messages # %s", delivery_tags)
+        for delivery_tag in delivery_tags:
+            channel.basic_ack(delivery_tag)
+
+    def _nack(self, channel, delivery_tags):
+        if channel is not self._channel or not channel.is_open:
+            LOG.warning("Channel closed before nack of messages # %s, they will be redelivered", delivery_tags)
+            return
+        LOG.debug("Sending nack for messages # %s", delivery_tags)
+        for delivery_tag in delivery_tags:
+            channel.basic_nack(delivery_tag, requeue=False)
 
     def stop_consuming(self):
         """Tells RabbitMQ to stop consuming by sending the Basic.Cancel RPC command."""
@@ -521,6 +623,13 @@ class Consumer:
             self._connection.ioloop.stop()
             LOG.debug("Consumer stopped")
 
+    def shutdown_workers(self):
+        """Waits for the messages being processed by the worker threads, if any."""
+        if self._pool is not None:
+            LOG.info("Waiting for workers to complete")
+            self._pool.shutdown()
+            self._pool = None
+
 
 class ReconnectingConsumer:
     """Consumer that will reconnect if the nested worker indicates that a reconnect is necessary."""
@@ -547,6 +656,7 @@ class ReconnectingConsumer:
                 self._consumer.run()
             except KeyboardInterrupt:
                 self._consumer.stop()
+                self._consumer.shutdown_workers()
                 break
             if not self._reconnect:
                 break
@@ -579,4 +689,5 @@ class ReconnectingConsumer:
 
     def stop(self):
         self._consumer.stop()
+        self._consumer.shutdown_workers()
         self._reconnect = False
@@ -0,0 +1,20 @@
+import threading
+from typing import List, Optional
+
+from importer.database.schemas import DownloadedDataSchema, GeoserverResourceSchema, MessageSchema
+from importer.dto.layer_publication_status import LayerPublicationStatus
+
+
+class ImportWorkItem:
+    def __init__(self, workspace: str, message: MessageSchema):
+        self.workspace: str = workspace
+        self.message: MessageSchema = message
+        self.data_list: List[DownloadedDataSchema] = []
+        self.saved_resources: List[GeoserverResourceSchema] = []
+        self.publication_status: List[LayerPublicationStatus] = []
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+
+    @property
+    def success(self):
+        return self.error is None
@@ -0,0 +1,31 @@
+from typing import List, Optional
+
+
+class LayerDeletion:
+    LAYER = "layer"
+    COVERAGESTORE = "coveragestore"
+    GRANULES = "granules"
+
+    def __init__(
+        self,
+        kind: str,
+        workspace: str,
+        name: str,
+        resource_ids: List[int],
+        location_prefix: Optional[str] = None,
+    ):
+        self.kind: str = kind
+        self.workspace: str = workspace
+        # layer name, or store name for coverage stores and mosaic granules
+        self.name: str = name
+        # ids of the geoserver_resource rows removed from GeoServer by this deletion
+        self.resource_ids: List[int] = resource_ids
+        self.location_prefix: Optional[str] = location_prefix
+        self.exception: Optional[str] = None
+
+    @property
+    def success(self):
+        return self.exception is None
+
+    def __repr__(self):
+        return f"LayerDeletion({self.kind} {self.workspace}:{self.name})"
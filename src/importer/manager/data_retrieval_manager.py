@@ -1,13 +1,17 @@
 import errno
+import hashlib
 import io
 import logging
 import os
 import re
+import shutil
+import tempfile
 import zipfile
-from typing import List
+from typing import List, Optional
 
 from importer.database.schemas import DownloadedDataSchema, MessageSchema
 from importer.driver.datalake_driver import DataLakeDriver
+from importer.settings.instance import settings
 
 LOG = logging.getLogger(__name__)
 
@@ -37,43 +41,75 @@ def sanitize(name: str):
 class DataRetrievalManager:
     def __init__(self):
         self.driver = DataLakeDriver()
+        self.chunk_size = settings.download_chunk_size
+        self.buffer_limit = settings.download_buffer_limit
+        self.parallel_threshold = settings.download_parallel_threshold
 
-    def download_data(self, project_name, message_schema: MessageSchema) -> List[DownloadedDataSchema]:
+    def download_data(
+        self,
+        project_name,
+        message_schema: MessageSchema,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> List[DownloadedDataSchema]:
         """Retrieve data contained in the received message from their urls.
         Returns a list containing the temporary folder where files were saved
         :param dict message: message coming from message bus, containing the
                              urls of the resources to download
+        :param etag, last_modified: validators of the previous download, if any. When the resource
+                             did not change, ResourceNotModified is raised and nothing is downloaded
         """
         data_list = []
 
-        r, url = self.driver.get(project_name, message_schema.id, message_schema.url)  # use driver to download data
+        # use driver to download data
+        r, url = self.driver.get(project_name, message_schema.id, message_schema.url, etag, last_modified)
+        etag, last_modified = self.driver.get_validators(r)
         filename = url.split("/")[-1]
         extension = filename.split(".")[-1]
-        tmp_path = os.path.join("temp", message_schema.id)  # create a temporary folder to save files to
+        # each message gets its own temporary folder, so that concurrent messages never share files
+        tmp_path = tempfile.mkdtemp(prefix=f"{sanitize(message_schema.id)}_", dir=settings.get_staging_folder())
         ismosaic = False
         isdbstored = False
-        if r.status_code == 200:
-            content = io.BytesIO(r.content)
-            if extension == "zip" or extension == "mapping":
-                try:
-                    z = zipfile.ZipFile(content)
-                    z.extractall(path=tmp_path)  # extract all files to folder
-                    z.close()
+        content_hash = hashlib.sha256()
+        try:
+            if r.status_code == 200:
+                if extension == "zip" or extension == "mapping":
+                    archive = self.fetch_body(
+                        project_name,
+                        message_schema.id,
+                        r,
+                        url,
+                        os.path.join(tmp_path, filename),
+                        buffer=True,
+                        content_hash=content_hash,
+                    )
+                    try:
+                        with zipfile.ZipFile(archive) as z:
+                            z.extractall(path=tmp_path)  # extract all files to folder
+                    except zipfile.BadZipFile as e:
+                        LOG.error(f"Invalid archive {filename} for resource {message_schema.id}")
+                        raise e
+                    finally:
+                        if isinstance(archive, str):
+                            os.remove(archive)
 
                     ismosaic = (extension == "mapping") or any(
                         [(f.endswith(".tif") or f.endswith(".tiff")) for f in os.listdir(tmp_path)]
                     )
                     isdbstored = not ismosaic
-                except zipfile.BadZipFile as e:
-                    LOG.error(r.content)
-                    raise e
-            elif extension in ["tif", "tiff", "json", "geojson", "kml", "nc", "ncml"]:
-                isdbstored = extension in ["json", "geojson", "kml"]
-                with safe_open(os.path.join(tmp_path, filename), "wb") as f:  # save the single file to folder
-                    for chunk in r:
-                        f.write(chunk)
-            else:
-                LOG.error(f"File with extension {extension} not supported")
+                elif extension in ["tif", "tiff", "json", "geojson", "kml", "nc", "ncml"]:
+                    isdbstored = extension in ["json", "geojson", "kml"]
+                    # save the single file to folder
+                    filepath = os.path.join(tmp_path, filename)
+                    self.fetch_body(project_name, message_schema.id, r, url, filepath, content_hash=content_hash)
+                else:
+                    LOG.error(f"File with extension {extension} not supported")
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        finally:
+            r.close()
+        if r.status_code == 200:
             store_name = "postgis_db" if isdbstored else None
             data = DownloadedDataSchema(
                 workspace=project_name,
@@ -90,7 +126,53 @@ class DataRetrievalManager:
                 request_code=message_schema.request_code,
                 tmp_path=tmp_path,
                 mosaic=ismosaic,
+                content_hash=content_hash.hexdigest(),
+                etag=etag,
+                last_modified=last_modified,
             )
             data_list.append(data)
+        else:
+            LOG.error(f"Resource {message_schema.id} cannot be downloaded: {r.status_code}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
         LOG.info(f'{len(data_list)} resource{"s" if len(data_list) > 1 else ""} downloaded')
         return data_list
+
+    def stream_to_file(self, response, path: str, content_hash=None):
+        """Write the body of a streamed response to path, one chunk at a time"""
+        with safe_open(path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                if content_hash:
+                    content_hash.update(chunk)
+                f.write(chunk)
+        return path
+
+    def fetch_body(
+        self,
+        project_name: str,
+        resource_id: str,
+        response,
+        url: str,
+        path: str,
+        buffer: bool = False,
+        content_hash=None,
+    ):
+        """Retrieve the body of a streamed response.
+        Large files are fetched with parallel range requests when the server supports them, otherwise the
+        response is streamed to path. With buffer, small bodies (up to buffer_limit) are returned as an
+        in-memory buffer instead, so that large archives are never held in memory.
+        If provided, content_hash (a hashlib object) is updated with the body as it is received.
+        Returns either the path of the saved file or the buffer.
+        """
+        try:
+            length = int(response.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            length = None
+        if length is not None and length >= self.parallel_threshold and self.driver.accepts_ranges(response):
+            response.close()
+            return self.driver.download_ranged(project_name, resource_id, url, path, length, content_hash)
+        if buffer and length is not None and length <= self.buffer_limit:
+            content = response.content
+            if content_hash:
+                content_hash.update(content)
+            return io.BytesIO(content)
+        return self.stream_to_file(response, path, content_hash)
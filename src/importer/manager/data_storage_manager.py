@@ -1,9 +1,12 @@
 import glob
 import json
 import logging
+import multiprocessing
 import os
 import shutil
-from datetime import datetime
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
@@ -15,27 +18,47 @@ from rasterio.transform import from_origin
 from shapely.geometry import shape
 from shapely.geometry.multipolygon import MultiPolygon
 from shapely.geometry.polygon import Polygon
-from sqlalchemy import func
+from sqlalchemy import and_, delete, func, or_, text, tuple_, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.session import Session
 from sqlalchemy.sql.schema import Column
 from sqlalchemy.sql.sqltypes import DateTime
 
 from importer.database.extensions import db_session
+from importer.database.layer_settings_cache import layer_settings_cache
 from importer.database.models import GeoserverResource, LayerSettings
 from importer.database.schemas import (
     DownloadedDataSchema,
     GeoserverResourceSchema,
     LayerSettingsSchema,
+    MessageSchema,
 )
 from importer.database.session import SessionLocal
 from importer.driver.postgis_driver import PostGISDriver
 from importer.dto.layer_publication_status import LayerPublicationStatus
+from importer.manager.trash_reaper import trash_reaper
 from importer.settings.instance import settings
-from importer.util.datetimeutils import isoformat_Z
+from importer.util.cogutils import convert_to_cog
+from importer.util.datetimeutils import distinct_isoformat_Z, isoformat_Z, set_utc_default_tz
+from importer.util.fileutils import place_file
+from importer.util.keyedlock import KeyedLock
+from importer.util.netcdfutils import time_axis_cache_path
 
 LOG = logging.getLogger(__name__)
 
+# entries of layer_settings.parameters configuring the ingest, not sent to GeoServer
+INGEST_PARAMETERS = ("cog", "time_mosaic")
+# time of the granules of a time-enabled mosaic, in their file names
+GRANULE_TIME_FORMAT = "%Y%m%dT%H%M%SZ"
+GRANULE_TIME_REGEX = "[0-9]{8}T[0-9]{6}Z"
+GRANULE_TIME_JAVA_FORMAT = "yyyyMMdd'T'HHmmss'Z'"
+
+# shared by every DataStorageManager, created on the first COG conversion
+_cog_pool: Optional[ProcessPoolExecutor] = None
+_cog_pool_lock = threading.Lock()
+
 
 class DataStorageManager:
     def __init__(self):
@@ -43,6 +66,9 @@ class DataStorageManager:
         self.geoserver_file_storage_dir = settings.geoserver_data_dir
         self.geoserver_tif_folder = settings.geoserver_tif_folder
         self.geoserver_imagemosaic_folder = settings.geoserver_imagemosaic_folder
+        self._resource_table_partitioned: Optional[bool] = None
+        # (workspace, resource_id) being imported or deleted, shared by the consumers and the retention thread
+        self.resource_locks = KeyedLock()
 
     def save_resources(
         self, data_list: List[DownloadedDataSchema], vectorize_tif: bool = False
@@ -81,11 +107,25 @@ class DataStorageManager:
             all_saved_resources.append(saved_resource)
         return all_saved_resources
 
-    def dumps_json(self, x):
-        if isinstance(x, dict):
-            return json.dumps(x)
-        else:
-            return x
+    def read_vector(self, filename: str) -> gpd.GeoDataFrame:
+        """Reads a vector file with the columnar pyogrio/Arrow reader, falling back to Fiona if it fails"""
+        if settings.vector_reader_arrow:
+            try:
+                return gpd.read_file(filename, engine="pyogrio", use_arrow=True)
+            except Exception as e:
+                LOG.warning(f"Arrow reader failed on {filename}, falling back to Fiona: {e}")
+        return gpd.read_file(filename, engine="fiona")
+
+    def serialize_dicts(self, gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+        """Serializes in place the nested properties (dicts) as JSON strings, only object columns are scanned"""
+        for column in gdf.columns:
+            if column == gdf.geometry.name or gdf[column].dtype != object:
+                continue
+            values = gdf[column]
+            is_dict = values.map(type) == dict
+            if is_dict.any():
+                gdf[column] = values.where(~is_dict, values[is_dict].map(json.dumps))
+        return gdf
 
     def convert_to_gpd(
         self, data: DownloadedDataSchema, vectorize_tif: bool
@@ -94,9 +134,11 @@ class DataStorageManager:
         for ext in ["shp", "json", "geojson"]:
             for index, filename in enumerate(glob.glob(os.path.join(data.tmp_path, f"**/*.{ext}"), recursive=True)):
                 try:
-                    gdf = gpd.read_file(filename)
-                    gpd_dfs.append(gdf.map(lambda x: self.dumps_json(x)))
+                    gdf = self.serialize_dicts(self.read_vector(filename))
                     saved_resource = self.pack_resource(data, index)
+                    saved_resource.timestamps = self.get_timestamps_from_gdf(gdf, data.workspace, data.datatype_id)
+                    # appended together, save_resources pairs the dataframes with their resources
+                    gpd_dfs.append(gdf)
                     saved_resources.append(saved_resource)
                 except Exception as e:
                     LOG.error(str(e))
@@ -104,8 +146,10 @@ class DataStorageManager:
         for index, filename in enumerate(glob.glob(os.path.join(data.tmp_path, "**/*.kml"), recursive=True)):
             try:
                 gpd.io.file.fiona.drvsupport.supported_drivers["KML"] = "rw"
-                gpd_dfs.append(gpd.read_file(filename, driver="KML"))
+                gdf = gpd.read_file(filename, driver="KML")
                 saved_resource = self.pack_resource(data, index)
+                saved_resource.timestamps = self.get_timestamps_from_gdf(gdf, data.workspace, data.datatype_id)
+                gpd_dfs.append(gdf)
                 saved_resources.append(saved_resource)
             except Exception as e:
                 LOG.error(str(e))
@@ -131,20 +175,51 @@ class DataStorageManager:
                                 geotransform = (xmin, ymin, xres, yres)
                                 for shp, _ in rasterio.features.shapes(image, transform=from_origin(*geotransform)):
                                     geometry.append(shape(shp))
-                                gpd_dfs.append(gpd.GeoDataFrame(geometry=geometry))
                                 saved_resource = self.pack_resource(data, index)
+                                gpd_dfs.append(gpd.GeoDataFrame(geometry=geometry))
                                 saved_resources.append(saved_resource)
                     except Exception as e:
                         LOG.error(str(e))
                         continue
         return gpd_dfs, saved_resources
 
+    def optimize_rasters(self, data: DownloadedDataSchema, filepaths: List[str]):
+        """Rewrites the GeoTIFFs as COG in the process pool, if enabled for the datatype.
+        Files that cannot be converted are published as they are."""
+        options = self.get_cog_options(data.workspace, data.datatype_id)
+        if options is None or not filepaths:
+            return
+        futures = {self.cog_pool().submit(convert_to_cog, filepath, options): filepath for filepath in filepaths}
+        for future in as_completed(futures):
+            try:
+                converted = future.result()
+                LOG.info(f"{futures[future]} {'converted to COG' if converted else 'already COG'}")
+            except Exception as e:
+                LOG.error(f"COG conversion of {futures[future]} failed, keeping the original: {e}")
+
+    @staticmethod
+    def cog_pool() -> ProcessPoolExecutor:
+        global _cog_pool
+        with _cog_pool_lock:
+            if _cog_pool is None:
+                # spawn, since forking a process running pika and worker threads is unsafe
+                _cog_pool = ProcessPoolExecutor(
+                    max_workers=settings.cog_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+        return _cog_pool
+
     def save_to_file_storage(
         self, data: DownloadedDataSchema, all_saved_resources: List[GeoserverResource], vectorize_tif: bool
     ):
+        # rasters of datatypes published as a single time-enabled mosaic are added to it as granules
+        time_mosaic = self.has_time_mosaic(data.workspace, data.datatype_id)
+        granule_time = set_utc_default_tz(data.start).astimezone(timezone.utc).strftime(GRANULE_TIME_FORMAT)
+        granules = []
         if not vectorize_tif or data.mosaic:
             for ext in ["tif", "tiff"]:
-                if data.mosaic:
+                if time_mosaic:
+                    base_path = self.get_time_mosaic_path(data.workspace, data.datatype_id)
+                elif data.mosaic:
                     base_path = os.path.join(
                         self.geoserver_file_storage_dir,
                         self.geoserver_imagemosaic_folder,
@@ -156,20 +231,31 @@ class DataStorageManager:
                 os.makedirs(base_path, exist_ok=True)
                 os.chmod(base_path, 0o777)
                 index = -1
-                for index, filepath in enumerate(
-                    glob.glob(os.path.join(data.tmp_path, f"**/*.{ext}"), recursive=True)
-                ):
+                filepaths = glob.glob(os.path.join(data.tmp_path, f"**/*.{ext}"), recursive=True)
+                self.optimize_rasters(data, filepaths)
+                for index, filepath in enumerate(filepaths):
                     # Build file storage location
-                    storage_location = os.path.join(base_path, f"{data.datatype_id}_{data.resource_id}_{index}.{ext}")
-                    # Save file to storage location
-                    shutil.copyfile(filepath, storage_location)
-                    LOG.info(storage_location)
-                    if not data.mosaic:
+                    filename = f"{data.datatype_id}_{data.resource_id}_{index}"
+                    if time_mosaic:
+                        # the mosaic reads the time of the granule from its name
+                        filename = f"{filename}_{granule_time}"
+                    storage_location = os.path.join(base_path, f"{filename}.{ext}")
+                    # Move file to storage location, the temp folder is removed afterwards
+                    strategy = place_file(filepath, storage_location)
+                    LOG.info(f"{storage_location} ({strategy})")
+                    if time_mosaic:
+                        granules.append(storage_location)
+                    elif not data.mosaic:
                         saved_resource = self.pack_resource(data, index, storage_location)
                         all_saved_resources.append(saved_resource)
-                if data.mosaic and index >= 0:
+                if data.mosaic and not time_mosaic and index >= 0:
                     saved_resource = self.pack_resource(data, 0, base_path)
                     all_saved_resources.append(saved_resource)
+        if granules:
+            base_path = self.get_time_mosaic_path(data.workspace, data.datatype_id)
+            self.configure_time_mosaic(base_path, data.workspace, data.datatype_id)
+            saved_resource = self.pack_resource(data, 0, base_path, granule=True)
+            all_saved_resources.append(saved_resource)
         for ext in ["nc", "ncml"]:
             for index, filepath in enumerate(glob.glob(os.path.join(data.tmp_path, f"**/*.{ext}"), recursive=True)):
                 # There is no a folder for NetCDF, since the geoserver NetCDF plugin creates a couple of auxiliary
@@ -180,24 +266,32 @@ class DataStorageManager:
                     self.geoserver_file_storage_dir, f"{data.datatype_id}_{data.resource_id}.{ext}"
                 )
                 Path(os.path.join(*storage_location.split("/")[:-1])).mkdir(parents=True, exist_ok=True)
-                shutil.copyfile(filepath, storage_location)
-                LOG.info(storage_location)
+                strategy = place_file(filepath, storage_location)
+                LOG.info(f"{storage_location} ({strategy})")
                 # Save resource on db
                 saved_resource = self.pack_resource(data, index, storage_location)
                 all_saved_resources.append(saved_resource)
         return all_saved_resources
 
-    def pack_resource(self, data: DownloadedDataSchema, index: int, storage_location=None) -> GeoserverResourceSchema:
-        """Save a new resource entry on PostGIS db"""
+    def pack_resource(
+        self, data: DownloadedDataSchema, index: int, storage_location=None, granule: bool = False
+    ) -> GeoserverResourceSchema:
+        """Save a new resource entry on PostGIS db.
+        Granules are the files of a resource added to the time-enabled mosaic of its datatype."""
         geometry = shape(data.bbox).buffer(0)
         if isinstance(geometry, Polygon):
             geometry = MultiPolygon([geometry])
         bbox = from_shape(geometry, srid=4326)
+        if granule:
+            store_name = layer_name = self.get_time_mosaic_name(data.datatype_id)
+        else:
+            store_name = data.store_name if data.store_name else f"{data.datatype_id}_{data.resource_id}"
+            layer_name = f'{data.datatype_id}_{data.resource_id}{f"_{index}" if index > 0 else ""}'
         packed_resource = GeoserverResourceSchema(
             datatype_id=data.datatype_id,
             workspace=data.workspace,
-            store_name=data.store_name if data.store_name else f"{data.datatype_id}_{data.resource_id}",
-            layer_name=f'{data.datatype_id}_{data.resource_id}{f"_{index}" if index > 0 else ""}',
+            store_name=store_name,
+            layer_name=layer_name,
             layer_title=data.resource_name,
             storage_location=storage_location,
             expire_on=None,
@@ -209,26 +303,89 @@ class DataStorageManager:
             dest_org=data.destinatary_organization,
             request_code=data.request_code,
             bbox=bbox,
-            mosaic=data.mosaic,
+            mosaic=data.mosaic or granule,
+            granule=granule,
+            content_hash=data.content_hash,
+            etag=data.etag,
+            last_modified=data.last_modified,
         )
 
         return packed_resource
 
+    @staticmethod
+    def get_time_mosaic_name(datatype_id: str) -> str:
+        """Name of the store and of the layer of the time-enabled mosaic of a datatype"""
+        return f"{datatype_id}_mosaic"
+
+    def get_time_mosaic_path(self, workspace: str, datatype_id: str) -> str:
+        return os.path.join(
+            self.geoserver_file_storage_dir,
+            self.geoserver_imagemosaic_folder,
+            f"{workspace}_{self.get_time_mosaic_name(datatype_id)}",
+        )
+
+    @staticmethod
+    def get_granule_prefix(resource: GeoserverResource) -> str:
+        """Path prefix shared by the granules of a resource, see save_to_file_storage"""
+        return os.path.join(resource.storage_location, f"{resource.datatype_id}_{resource.resource_id}_")
+
+    def configure_time_mosaic(self, mosaic_path: str, workspace: str, datatype_id: str):
+        """Writes the configuration of a time-enabled ImageMosaic with its index on PostGIS, if missing.
+        GeoServer reads it when the first granule is harvested."""
+        name = self.get_time_mosaic_name(datatype_id)
+        files = {
+            "indexer.properties": [
+                f"Name={name}",
+                f"TypeName=mosaic_{workspace}_{name}".lower(),
+                "TimeAttribute=ingestion",
+                "Schema=*the_geom:Polygon,location:String,ingestion:java.util.Date",
+                "PropertyCollectors=TimestampFileNameExtractorSPI[timeregex](ingestion)",
+                "AbsolutePath=true",
+                "Caching=false",
+                "CanBeEmpty=true",
+            ],
+            "timeregex.properties": [f"regex={GRANULE_TIME_REGEX},format={GRANULE_TIME_JAVA_FORMAT}"],
+            "datastore.properties": [
+                "SPI=org.geotools.data.postgis.PostgisNGDataStoreFactory",
+                f"host={settings.database_host}",
+                f"port={settings.database_port}",
+                f"database={settings.database_name}",
+                "schema=public",
+                f"user={settings.database_user}",
+                f"passwd={settings.database_pass}",
+                "Loose\\ bbox=true",
+                "Estimated\\ extends=false",
+                "validate\\ connections=true",
+                "Connection\\ timeout=10",
+                "preparedStatements=true",
+            ],
+        }
+        for filename, lines in files.items():
+            path = os.path.join(mosaic_path, filename)
+            if not os.path.exists(path):
+                with open(path, "w") as f:
+                    f.write("\n".join(lines) + "\n")
+
     def add_resources_entries(
         self, resources: List[GeoserverResourceSchema], all_pubstatus: List[LayerPublicationStatus]
-    ) -> GeoserverResourceSchema:
-        """Save the resource entries on PostGIS db"""
+    ) -> int:
+        """
+        Save the entries of the published layers on PostGIS db, with a single statement.
+        Layers that already have a live entry (e.g. a redelivered message) are skipped.
+        :return: number of inserted entries
+        """
         resource_dict = {}
 
         for resource in resources:
             resource_dict[resource.layer_name] = resource
 
+        rows = []
         for pubstatus in all_pubstatus:
             resource = resource_dict[pubstatus.original_name]
 
             if pubstatus.success and pubstatus.is_layer:
-                with db_session() as session:
-                    saved_resource = GeoserverResource(
+                rows.append(
+                    dict(
                         datatype_id=pubstatus.datatype,
                         workspace=resource.workspace,
                         store_name=resource.store_name,
@@ -237,13 +394,11 @@ class DataStorageManager:
                         expire_on=resource.expire_on,
                         start=resource.start,
                         end=resource.end,
-                        created_at=resource.creation_date,
+                        created_at=resource.creation_date or datetime.utcnow(),
                         resource_id=resource.resource_id,
                         metadata_id=resource.metadata_id,
                         dest_org=(
-                            resource.dest_org
-                            if resource.dest_org and len(resource.dest_org.strip()) > 0
-                            else None
+                            resource.dest_org if resource.dest_org and len(resource.dest_org.strip()) > 0 else None
                         ),
                         request_code=(
                             resource.request_code
@@ -253,9 +408,137 @@ class DataStorageManager:
                         bbox=resource.bbox,
                         mosaic=resource.mosaic,
                         timestamps=";".join(pubstatus.timestamps),
+                        granule=resource.granule,
+                        content_hash=resource.content_hash,
+                        etag=resource.etag,
+                        last_modified=resource.last_modified,
                     )
-                    session.add(saved_resource)
-                    session.flush()
+                )
+        if not rows:
+            return 0
+        with db_session() as session:
+            if self.is_resource_table_partitioned(session):
+                inserted = self._insert_missing_live_entries(session, rows)
+            else:
+                # idempotent on the live layers, see the partial unique index of migration 6_time_mosaic_granules
+                statement = (
+                    insert(GeoserverResource)
+                    .values(rows)
+                    .on_conflict_do_nothing(
+                        index_elements=[
+                            GeoserverResource.workspace,
+                            GeoserverResource.layer_name,
+                            GeoserverResource.resource_id,
+                        ],
+                        index_where=GeoserverResource.deleted_at.is_(None),
+                    )
+                )
+                inserted = session.execute(statement).rowcount
+        if inserted < len(rows):
+            LOG.warning(f"{len(rows) - inserted} layers already had a live entry, skipped")
+        return inserted
+
+    @staticmethod
+    def _insert_missing_live_entries(session: Session, rows: List[dict]) -> int:
+        """
+        Inserts the rows of layers without a live entry, on a partitioned geoserver_resource.
+        Its unique indexes must include created_at, so they cannot tell a live layer apart:
+        the insertions of the same layers are serialized with transaction-level advisory locks instead.
+        """
+        keys = sorted({(row["workspace"], row["layer_name"], row["resource_id"]) for row in rows})
+        # in the same order for every transaction, so that they cannot deadlock
+        for key in keys:
+            session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": json.dumps(key)})
+        key_columns = (GeoserverResource.workspace, GeoserverResource.layer_name, GeoserverResource.resource_id)
+        live = set(
+            tuple(key)
+            for key in session.query(*key_columns).filter(
+                tuple_(*key_columns).in_(keys), GeoserverResource.deleted_at.is_(None)
+            )
+        )
+        missing = []
+        for row in rows:
+            key = (row["workspace"], row["layer_name"], row["resource_id"])
+            if key not in live:
+                live.add(key)
+                missing.append(row)
+        if missing:
+            session.execute(insert(GeoserverResource).values(missing))
+        return len(missing)
+
+    def is_resource_table_partitioned(self, session: Session) -> bool:
+        """Whether geoserver_resource has been partitioned by month, checked once"""
+        if self._resource_table_partitioned is None:
+            self._resource_table_partitioned = session.execute(
+                text(
+                    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                    "WHERE partrelid = to_regclass('geoserver_resource'))"
+                )
+            ).scalar()
+        return self._resource_table_partitioned
+
+    def create_resource_partitions(self, session: Session, months_ahead: int) -> int:
+        """Creates the missing monthly partitions of geoserver_resource up to months_ahead, if it is partitioned"""
+        if not self.is_resource_table_partitioned(session):
+            return 0
+        return session.execute(
+            text(
+                "SELECT create_geoserver_resource_partitions("
+                "date_trunc('month', now() AT TIME ZONE 'UTC')::timestamp, :months_ahead)"
+            ),
+            {"months_ahead": months_ahead},
+        ).scalar()
+
+    def get_unchanged_resources(
+        self, session: Session, workspace: str, resource_id: str, content_hash: Optional[str]
+    ) -> List[GeoserverResource]:
+        """Return the live layers of a resource if all of them were published from a payload with the given hash,
+        an empty list otherwise (i.e. the resource must be republished)"""
+        resources = self.get_resources(session=session, workspace=workspace, resource_id=resource_id)
+        if content_hash and resources and all(r.content_hash == content_hash for r in resources):
+            return resources
+        return []
+
+    def get_source_validators(
+        self, session: Session, workspace: str, resource_id: str
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """Return the (etag, last_modified) validators shared by the live layers of a resource, if any"""
+        resources = self.get_resources(session=session, workspace=workspace, resource_id=resource_id)
+        validators = set((r.etag, r.last_modified) for r in resources)
+        if len(validators) != 1:
+            return None, None
+        return validators.pop()
+
+    def refresh_resources(self, session: Session, resources: List[GeoserverResource], message: MessageSchema):
+        """Update the metadata of already published layers with the ones of a new notification"""
+        geometry = shape(message.geometry).buffer(0)
+        if isinstance(geometry, Polygon):
+            geometry = MultiPolygon([geometry])
+        for resource in resources:
+            # layers without a time axis carry the start date as their only timestamp
+            if resource.timestamps == isoformat_Z(set_utc_default_tz(resource.start)):
+                resource.timestamps = isoformat_Z(set_utc_default_tz(message.start_date))
+            resource.start = message.start_date
+            resource.end = message.end_date
+            # created_at keeps the date of the first publication, it is the partition key of geoserver_resource
+            resource.metadata_id = message.metadata_id
+            resource.dest_org = (
+                message.destinatary_organization
+                if message.destinatary_organization and len(message.destinatary_organization.strip()) > 0
+                else None
+            )
+            resource.request_code = (
+                message.request_code if message.request_code and len(message.request_code.strip()) > 0 else None
+            )
+            resource.bbox = from_shape(geometry, srid=4326)
+        session.flush()
+        LOG.info(f"Metadata refreshed for layers {[r.layer_name for r in resources]}")
+
+    @staticmethod
+    def discard_downloads(data_list: List[DownloadedDataSchema]):
+        """Remove the temporary folders of downloads that will not be saved"""
+        for data in data_list:
+            shutil.rmtree(data.tmp_path, ignore_errors=True)
 
     def get_resources(
             self,
@@ -283,6 +566,132 @@ class DataStorageManager:
             statement = statement.order_by(order_by)
         return statement.all()
 
+    def get_expired_resource_ids(
+        self,
+        session: Session,
+        workspace: str,
+        datatype_ids: Optional[List[str]] = None,
+        now: Optional[datetime] = None,
+    ) -> List[int]:
+        """
+        Finds with a single query the live resources of a workspace that must be deleted, because they reached
+        their expire_on date, are older than the delete_after_days of their datatype, or exceed its
+        delete_after_count (only the most recent ones are kept).
+
+        Args:
+            session: The session object used to query the database.
+            workspace: The workspace of the resources.
+            datatype_ids (optional): Restrict the sweep to these datatypes.
+            now (optional): Reference time, defaults to the current UTC time.
+
+        Returns:
+            List[int]: The ids of the expired resources.
+        """
+        now = now or datetime.utcnow()
+        settings_by_datatype = self.retention_settings_subquery(session, workspace)
+        ranked = (
+            session.query(
+                GeoserverResource.id.label("id"),
+                GeoserverResource.created_at.label("created_at"),
+                GeoserverResource.expire_on.label("expire_on"),
+                settings_by_datatype.c.delete_after_days,
+                settings_by_datatype.c.delete_after_count,
+                func.row_number()
+                .over(
+                    partition_by=GeoserverResource.datatype_id,
+                    order_by=(GeoserverResource.created_at.desc(), GeoserverResource.id.desc()),
+                )
+                .label("position"),
+            )
+            .outerjoin(settings_by_datatype, settings_by_datatype.c.datatype_id == GeoserverResource.datatype_id)
+            .filter(GeoserverResource.deleted_at.is_(None))
+            .filter(GeoserverResource.workspace == workspace)
+        )
+        if datatype_ids:
+            ranked = ranked.filter(GeoserverResource.datatype_id.in_(datatype_ids))
+        ranked = ranked.subquery()
+        statement = session.query(ranked.c.id).filter(
+            or_(
+                ranked.c.expire_on <= now,
+                and_(
+                    ranked.c.delete_after_days > 0,
+                    ranked.c.created_at + func.make_interval(0, 0, 0, ranked.c.delete_after_days) <= now,
+                ),
+                and_(ranked.c.delete_after_count > 0, ranked.c.position > ranked.c.delete_after_count),
+            )
+        )
+        return [row.id for row in statement.all()]
+
+    @staticmethod
+    def retention_settings_subquery(session: Session, workspace: str):
+        """Retention settings of the workspace, one row per datatype_id"""
+        return (
+            session.query(
+                LayerSettings.datatype_id.label("datatype_id"),
+                func.max(LayerSettings.delete_after_days).label("delete_after_days"),
+                func.max(LayerSettings.delete_after_count).label("delete_after_count"),
+            )
+            .filter(LayerSettings.project == workspace)
+            .group_by(LayerSettings.datatype_id)
+            .subquery()
+        )
+
+    def get_retention_due_dates(
+        self, session: Session, workspace: str, datatype_ids: Optional[List[str]] = None
+    ) -> Dict[str, datetime]:
+        """
+        Computes for each datatype of a workspace when its next live resource will expire, either because of
+        expire_on, delete_after_days or delete_after_count (already exceeded, hence due now).
+        Datatypes whose resources never expire are not returned.
+        """
+        settings_by_datatype = self.retention_settings_subquery(session, workspace)
+        statement = (
+            session.query(
+                GeoserverResource.datatype_id,
+                func.min(GeoserverResource.expire_on),
+                func.min(GeoserverResource.created_at),
+                func.count(GeoserverResource.id),
+                settings_by_datatype.c.delete_after_days,
+                settings_by_datatype.c.delete_after_count,
+            )
+            .outerjoin(settings_by_datatype, settings_by_datatype.c.datatype_id == GeoserverResource.datatype_id)
+            .filter(GeoserverResource.deleted_at.is_(None))
+            .filter(GeoserverResource.workspace == workspace)
+            .group_by(
+                GeoserverResource.datatype_id,
+                settings_by_datatype.c.delete_after_days,
+                settings_by_datatype.c.delete_after_count,
+            )
+        )
+        if datatype_ids:
+            statement = statement.filter(GeoserverResource.datatype_id.in_(datatype_ids))
+        now = datetime.now(timezone.utc)
+        due_dates = {}
+        for datatype_id, expire_on, created_at, count, delete_after_days, delete_after_count in statement.all():
+            candidates = []
+            if expire_on:
+                candidates.append(set_utc_default_tz(expire_on))
+            if delete_after_days and delete_after_days > 0:
+                candidates.append(set_utc_default_tz(created_at) + timedelta(days=delete_after_days))
+            if delete_after_count and delete_after_count > 0 and count > delete_after_count:
+                candidates.append(now)
+            if candidates:
+                due_dates[datatype_id] = min(candidates)
+        return due_dates
+
+    def get_workspaces(self, session: Session) -> List[str]:
+        """Workspaces having at least one live resource"""
+        statement = session.query(GeoserverResource.workspace).filter(GeoserverResource.deleted_at.is_(None))
+        return [row.workspace for row in statement.distinct().all()]
+
+    def get_resources_by_ids(self, session: Session, ids: List[int], live: bool = False) -> List[GeoserverResource]:
+        if not ids:
+            return []
+        statement = session.query(GeoserverResource).filter(GeoserverResource.id.in_(ids))
+        if live:
+            statement = statement.filter(GeoserverResource.deleted_at.is_(None))
+        return statement.order_by(GeoserverResource.created_at).all()
+
     def get_layer_settings(
         self,
         session,
@@ -343,85 +752,109 @@ class DataStorageManager:
         return result
 
     def get_layer_style(self, workspace: str, datatype_id: str = None) -> str:
-        with db_session() as session:
-            result = self.get_layer_settings(session, project=workspace, datatype_id=datatype_id)
-            try:
-                style = result.style
-            except AttributeError:
-                style = None
-                LOG.error(f"Style not found for datatype id: {datatype_id}")
+        result = layer_settings_cache.get(workspace, datatype_id)
+        try:
+            style = result.style
+        except AttributeError:
+            style = None
+            LOG.error(f"Style not found for datatype id: {datatype_id}")
 
         return style
 
     def has_time_dimension(self, workspace: str, datatype_id: str = None) -> str:
-        with db_session() as session:
-            result = self.get_layer_settings(session, project=workspace, datatype_id=datatype_id)
-            try:
-                time_dim = result.time_dimension
-                LOG.info(f"time dimension for datatype id {datatype_id}: {time_dim}")
-            except AttributeError:
-                time_dim = None
-                LOG.error(f"time dimension not found for datatype id: {datatype_id}")
+        result = layer_settings_cache.get(workspace, datatype_id)
+        try:
+            time_dim = result.time_dimension
+            LOG.info(f"time dimension for datatype id {datatype_id}: {time_dim}")
+        except AttributeError:
+            time_dim = None
+            LOG.error(f"time dimension not found for datatype id: {datatype_id}")
 
         return time_dim
 
     def get_netcdf_layers(self, workspace: str, master_datatype_id):
         layers = []
-        with db_session() as session:
-            result = self.get_layer_settings(session, project=workspace, master_datatype_id=master_datatype_id)
-            try:
-                # create list of value couple (datatype_id, var_name) if datatype_id is not None
-                for r in result:
-                    if r.datatype_id:
-                        layers.append(
-                            {"native": r.var_name, "rename": r.datatype_id, "time_dimension": r.time_dimension}
-                        )
-            except AttributeError:
-                LOG.error(f"No settings found for datatype id: {master_datatype_id}")
-                pass
+        result = layer_settings_cache.get_by_master(workspace, master_datatype_id)
+        # create list of value couple (datatype_id, var_name) if datatype_id is not None
+        for r in result:
+            if r.datatype_id:
+                layers.append({"native": r.var_name, "rename": r.datatype_id, "time_dimension": r.time_dimension})
+        if not result:
+            LOG.error(f"No settings found for datatype id: {master_datatype_id}")
         if not layers:
             layers = None
         return layers
 
     def get_parameters(self, workspace: str, datatype_id: str = None) -> str:
         par = None
-        with db_session() as session:
-            result = self.get_layer_settings(session, project=workspace, datatype_id=datatype_id)
-            try:
-                par = json.loads(result.parameters)
-                LOG.info(f"parameters for datatype id {datatype_id}: {par}")
-            except AttributeError:
-                par = None
-                LOG.error(f"parameters not found for datatype id: {datatype_id}")
-            except (ValueError, TypeError):
-                par = None
-                LOG.info(f"parameters null or not in JSON format for datatype id: {datatype_id}. Ignoring...")
+        result = layer_settings_cache.get(workspace, datatype_id)
+        try:
+            par = json.loads(result.parameters)
+            # these entries configure the ingest, they are not GeoServer coverage parameters
+            if isinstance(par, dict) and any([par.pop(key, None) is not None for key in INGEST_PARAMETERS]):
+                par = par or None
+            LOG.info(f"parameters for datatype id {datatype_id}: {par}")
+        except AttributeError:
+            par = None
+            LOG.error(f"parameters not found for datatype id: {datatype_id}")
+        except (ValueError, TypeError):
+            par = None
+            LOG.info(f"parameters null or not in JSON format for datatype id: {datatype_id}. Ignoring...")
 
         return par
 
+    def get_ingest_parameter(self, workspace: str, datatype_id: str, key: str):
+        """Entry of the datatype parameters configuring the ingest (see INGEST_PARAMETERS), None if missing"""
+        result = layer_settings_cache.get(workspace, datatype_id)
+        try:
+            return json.loads(result.parameters).get(key)
+        except (AttributeError, ValueError, TypeError):
+            return None
+
+    def has_time_mosaic(self, workspace: str, datatype_id: str = None) -> bool:
+        """Whether the rasters of the datatype are granules of a single time-enabled mosaic"""
+        return self.get_ingest_parameter(workspace, datatype_id, "time_mosaic") is True
+
+    def get_cog_options(self, workspace: str, datatype_id: str = None) -> Optional[dict]:
+        """COG creation options from the "cog" entry of the datatype parameters (true for the defaults),
+        None if rasters of the datatype must be published as they are"""
+        cog = self.get_ingest_parameter(workspace, datatype_id, "cog")
+        if cog is True:
+            return {}
+        return cog if isinstance(cog, dict) else None
+
     def get_time_attribute(self, workspace: str, datatype_id: str = None) -> str:
-        with db_session() as session:
-            result = self.get_layer_settings(session, project=workspace, datatype_id=datatype_id)
-            try:
-                time_attribute = result.time_attribute
-            except AttributeError:
-                time_attribute = None
-                LOG.error(f"time attribute not found for datatype id: {datatype_id}")
+        result = layer_settings_cache.get(workspace, datatype_id)
+        try:
+            time_attribute = result.time_attribute
+        except AttributeError:
+            time_attribute = None
+            LOG.error(f"time attribute not found for datatype id: {datatype_id}")
 
         return time_attribute
 
+    def get_timestamps_from_gdf(self, gdf: gpd.GeoDataFrame, workspace: str, datatype_id: str) -> Optional[str]:
+        """Timestamps of a time-enabled vector layer, joined by ';', computed from the dataframe before loading it.
+        None if the datatype has no time dimension or the time attribute is missing."""
+        if not self.has_time_dimension(workspace, datatype_id):
+            return None
+        time_attribute = self.get_time_attribute(workspace, datatype_id)
+        if time_attribute not in gdf.columns:
+            LOG.error(f"time attribute {time_attribute} not found in vector data of datatype id: {datatype_id}")
+            return None
+        timestamps = distinct_isoformat_Z(gdf[time_attribute])
+        return ";".join(timestamps) if timestamps else None
+
     def get_timestamps_from_vector(self, layer_name: str, time_attribute: str) -> list:
+        """Timestamps of a time-enabled vector layer already loaded on PostGIS, computed server-side"""
         if time_attribute is None:
             return []
-        gdf = self.driver.get_table(layer_name)
         try:
-            gdf_timestamps = gdf[time_attribute].map(lambda x: isoformat_Z(x))
-            timestamps = sorted(list(gdf_timestamps.unique()))
-            LOG.info(f"timestamps for layer {layer_name}: {timestamps}")
+            timestamps = distinct_isoformat_Z(self.driver.get_distinct_values(layer_name, time_attribute))
         except Exception:
             timestamps = []
             LOG.error(f"no timestamps for layer {layer_name}")
-        LOG.info(f"timestamps for layer {layer_name}: {sorted(timestamps)}")
+        LOG.info(f"timestamps for layer {layer_name}: {timestamps}")
         return timestamps
 
     def countlayers_perresource(self, session: SessionLocal, resources: List[GeoserverResource]) -> Dict[str, int]:
@@ -441,31 +874,115 @@ class DataStorageManager:
         resourcelayercount: Dict[str, int],
         remove: bool = False,
     ):
+        """
+        Soft-deletes (or removes) the live resources with a single statement, then moves the files of the ones
+        actually deleted to the trash, where they are deleted after the commit.
+        The resources may be detached from the session, e.g. loaded in a previous transaction.
+        """
+        if not resources:
+            return
+        ids = [resource.id for resource in resources]
+        LOG.info(f"Deleting layers {[resource.layer_name for resource in resources]} from db")
+        if remove:
+            statement = delete(GeoserverResource).where(GeoserverResource.id.in_(ids))
+        else:
+            statement = update(GeoserverResource).values(deleted_at=datetime.utcnow())
+        # rows deleted meanwhile, e.g. by an update, may have left their files to a new live layer
+        statement = statement.where(GeoserverResource.id.in_(ids), GeoserverResource.deleted_at.is_(None))
+        deleted_ids = set(session.execute(statement.returning(GeoserverResource.id)).scalars())
+        session.flush()
+        if len(deleted_ids) < len(ids):
+            LOG.info(f"{len(ids) - len(deleted_ids)} layers were already deleted, their files are kept")
+            resources = [resource for resource in resources if resource.id in deleted_ids]
+
         rlc_copy = {k: v for k, v in resourcelayercount.items()}
         for resource in resources:
             try:
-                LOG.info(f"Deleting layer {resource.layer_name} from db")
-                if remove:
-                    session.delete(resource)
-                else:
-                    resource.deleted_at = datetime.utcnow()
-                session.flush()
-
                 if resource.storage_location is None:
-                    LOG.info(f"Dropping table {resource.layer_name} from db")
-                    # self.driver.drop_table(table_name=resource.layer_name)
+                    LOG.info(f"Table {resource.layer_name} will be dropped by the purge job")
+                elif resource.granule:
+                    # the mosaic folder is shared by the resources of the datatype
+                    for granule in glob.glob(f"{glob.escape(self.get_granule_prefix(resource))}*"):
+                        LOG.info(f"Deleting granule {granule}")
+                        trash_reaper.trash(session, granule)
                 elif rlc_copy[resource.resource_id] == 1:
                     if os.path.isfile(resource.storage_location):
                         LOG.info(f"Deleting file {resource.storage_location}")
-                        os.remove(resource.storage_location)
+                        trash_reaper.trash(session, resource.storage_location)
+                        if os.path.isfile(time_axis_cache_path(resource.storage_location)):
+                            trash_reaper.trash(session, time_axis_cache_path(resource.storage_location))
                     elif os.path.isdir(resource.storage_location):
                         LOG.info(f"Deleting folder {resource.storage_location}")
-                        shutil.rmtree(resource.storage_location)
+                        trash_reaper.trash(session, resource.storage_location)
 
                 rlc_copy[resource.resource_id] -= 1
             except Exception as e:
                 LOG.error(str(e))
 
+    def purge_deleted_resources(
+        self, session: Session, deleted_before: datetime, batch_size: int, lock_timeout: int
+    ) -> Tuple[int, int]:
+        """
+        Purges a batch of resources soft-deleted before the given time: drops the PostGIS tables of vector layers
+        no longer referenced by a resource that is live or deleted after that time, then moves the rows
+        into geoserver_resource_archive.
+        Tables locked for longer than lock_timeout are skipped, and their rows kept for the next purge.
+
+        Args:
+            session: The session object used to query the database.
+            deleted_before: Only the resources deleted before this time are purged.
+            batch_size: Maximum number of rows purged.
+            lock_timeout: Milliseconds to wait for the lock of each table.
+
+        Returns:
+            Tuple[int, int]: The number of dropped tables and archived rows.
+        """
+        rows = (
+            session.query(GeoserverResource.id, GeoserverResource.layer_name, GeoserverResource.storage_location)
+            .filter(GeoserverResource.deleted_at < deleted_before)
+            .order_by(GeoserverResource.deleted_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not rows:
+            return 0, 0
+        tables = {layer_name for _, layer_name, storage_location in rows if storage_location is None}
+        # a table is still in use while any of its rows is not purgeable yet, live or deleted after deleted_before
+        live_tables = {
+            layer_name
+            for (layer_name,) in session.query(GeoserverResource.layer_name)
+            .filter(
+                GeoserverResource.layer_name.in_(tables),
+                or_(GeoserverResource.deleted_at.is_(None), GeoserverResource.deleted_at >= deleted_before),
+            )
+            .distinct()
+        }
+        session.execute(text(f"SET LOCAL lock_timeout = {int(lock_timeout)}"))
+        skipped_tables = set()
+        for table in sorted(tables - live_tables):
+            try:
+                with session.begin_nested():
+                    quoted_table = table.replace('"', '""')
+                    session.execute(text(f'DROP TABLE IF EXISTS "{quoted_table}"'))
+            except OperationalError as e:
+                LOG.warning(f"Table {table} can not be dropped, retrying at the next purge: {e.orig}")
+                skipped_tables.add(table)
+        archived_ids = [
+            resource_id
+            for resource_id, layer_name, storage_location in rows
+            if storage_location is not None or layer_name not in skipped_tables
+        ]
+        columns = ", ".join(f'"{column.name}"' for column in GeoserverResource.__table__.columns)
+        session.execute(
+            text(
+                f"WITH moved AS (DELETE FROM geoserver_resource WHERE id = ANY(:ids) RETURNING {columns}) "
+                f"INSERT INTO geoserver_resource_archive ({columns}) SELECT {columns} FROM moved"
+            ),
+            {"ids": archived_ids},
+        )
+        return len(tables - live_tables - skipped_tables), len(archived_ids)
+
     @staticmethod
     def drop_empty_folders(directory):
         """Verify that every empty folder removed in local storage."""
@@ -1,11 +1,15 @@
 import logging
-from typing import Dict, List
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 from importer.database.models import GeoserverResource
 from importer.database.schemas import GeoserverResourceSchema
 from importer.driver.geoserver_driver import GeoserverDriver
+from importer.dto.layer_deletion import LayerDeletion
 from importer.dto.layer_publication_status import LayerPublicationStatus
 from importer.dto.layer_publication_status import LayerPublicationStatus
+from importer.settings.instance import settings
 
 LOG = logging.getLogger(__name__)
 
@@ -13,39 +17,112 @@ LOG = logging.getLogger(__name__)
 class GeoserverManager:
     def __init__(self):
         self.driver = GeoserverDriver()
+        # REST requests are also bounded by the driver, this only limits the resources published at once
+        max_workers = settings.geoserver_max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="publish")
+
+    def load_catalog(self):
+        self.driver.load_catalog()
 
     def publish(self, resources: List[GeoserverResourceSchema]) -> List[LayerPublicationStatus]:
+        """Publishes the resources concurrently, the statuses are returned in the order of the resources"""
+        if len(resources) == 1:
+            return self.publish_resource(resources[0])
         all_pubstatus = []
+        for pubstatuses in self._executor.map(self.publish_resource, resources):
+            all_pubstatus.extend(pubstatuses)
+        return all_pubstatus
+
+    def publish_resource(self, resource: GeoserverResourceSchema) -> List[LayerPublicationStatus]:
+        if resource.granule:
+            return self.driver.publish_granules(
+                workspace=resource.workspace,
+                layer_name=resource.layer_name,
+                storage_location=resource.storage_location,
+                resource_id=resource.resource_id,
+                datatype=resource.datatype_id,
+                start_time=resource.start,
+            )
+        elif resource.storage_location:
+            return self.driver.publish_from_location(
+                workspace=resource.workspace,
+                layer_name=resource.layer_name,
+                layer_title=resource.layer_title,
+                storage_location=resource.storage_location,
+                datatype=resource.datatype_id,
+                start_time=resource.start,
+                mosaic=resource.mosaic,
+            )
+        else:
+            return self.driver.publish_from_db(
+                workspace=resource.workspace,
+                store_name=resource.store_name,
+                layer_name=resource.layer_name,
+                layer_title=resource.layer_title,
+                datatype=resource.datatype_id,
+                start_time=resource.start,
+                timestamps=resource.timestamps.split(";") if resource.timestamps else None,
+            )
+
+    def delete(
+        self,
+        resources: List[GeoserverResource],
+        resourcelayercount: Dict[str, int],
+    ) -> Dict[int, Optional[str]]:
+        """
+        Removes the resources from GeoServer with as few requests as possible, sent concurrently.
+        A coverage store whose resources are all deleted is removed at once with its layers,
+        the other layers one by one, and granules from their mosaic.
+        :param resources:          layers to delete
+        :param resourcelayercount: number of live layers of each resource_id
+        :return:                   error of each layer by geoserver_resource id, None when deleted
+        """
+        deleted_count = Counter(resource.resource_id for resource in resources)
+        stores = defaultdict(list)
+        deletions = []
         for resource in resources:
-            if resource.storage_location:
-                pubstatuses = self.driver.publish_from_location(
-                    workspace=resource.workspace,
-                    layer_name=resource.layer_name,
-                    layer_title=resource.layer_title,
-                    storage_location=resource.storage_location,
-                    datatype=resource.datatype_id,
-                    start_time=resource.start,
-                    mosaic=resource.mosaic,
+            if resource.granule:
+                # the mosaic layer is shared by the datatype, only the granules of the resource are removed
+                deletions.append(
+                    LayerDeletion(
+                        LayerDeletion.GRANULES,
+                        resource.workspace,
+                        resource.store_name,
+                        [resource.id],
+                        location_prefix=self.driver.dsm.get_granule_prefix(resource),
+                    )
                 )
+            elif resource.storage_location is not None:
+                stores[(resource.workspace, resource.store_name)].append(resource)
             else:
-                pubstatuses = self.driver.publish_from_db(
-                    workspace=resource.workspace,
-                    store_name=resource.store_name,
-                    layer_name=resource.layer_name,
-                    layer_title=resource.layer_title,
-                    datatype=resource.datatype_id,
-                    start_time=resource.start,
+                deletions.append(
+                    LayerDeletion(LayerDeletion.LAYER, resource.workspace, resource.layer_name, [resource.id])
                 )
-            all_pubstatus.extend(pubstatuses)
-        return all_pubstatus
+        for (workspace, store_name), store_resources in stores.items():
+            if all(deleted_count[r.resource_id] >= resourcelayercount.get(r.resource_id, 0) for r in store_resources):
+                deletions.append(
+                    LayerDeletion(LayerDeletion.COVERAGESTORE, workspace, store_name, [r.id for r in store_resources])
+                )
+            else:
+                # other layers of the store are still live, the store is kept
+                deletions.extend(
+                    LayerDeletion(LayerDeletion.LAYER, workspace, r.layer_name, [r.id]) for r in store_resources
+                )
+        LOG.info(f"Deleting {len(resources)} layers from GeoServer with {len(deletions)} requests")
+        return {
+            resource_id: deletion.exception
+            for deletion in self.driver.delete_layers(deletions)
+            for resource_id in deletion.resource_ids
+        }
 
-    def delete(self, resources: List[GeoserverResource], resourcelayercount: Dict[str, int]):
-        rlc_copy = {k: v for k, v in resourcelayercount.items()}
+    def update_titles(self, resources: List[GeoserverResource], title: str):
         for resource in resources:
-            self.driver.delete_layer(
+            if resource.granule:
+                # the title of the mosaic describes the datatype, not a single resource
+                continue
+            self.driver.update_layer_title(
                 workspace=resource.workspace,
                 layer_name=resource.layer_name,
-                store_name=resource.store_name,
-                is_coveragestore=resource.storage_location is not None and rlc_copy[resource.resource_id] == 1,
+                title=title,
+                is_netcdf=(resource.storage_location or "").split(".")[-1] in ["nc", "ncml"],
             )
-            rlc_copy[resource.resource_id] -= 1
@@ -43,11 +43,39 @@ class MessageBusManager:
             self.cert_file,
             self.key_file,
             self.broker_vhost,
-            callback
+            callback,
+            prefetch=settings.rabbitmq_prefetch or settings.importer_workers,
+            workers=settings.importer_workers,
+            key_func=self.resource_key,
+            heartbeat=settings.rabbitmq_heartbeat,
+            coalesce_window=settings.importer_coalesce_window,
+            merge_func=self.merge_messages,
         )
         rabbitmq_reconnecting_consumer = ReconnectingConsumer(rabbitmq_consumer, self.consumer_routing)
         return rabbitmq_reconnecting_consumer
 
+    @staticmethod
+    def resource_key(message):
+        """Ordering key of a notification: messages about the same resource must not be reordered"""
+        if isinstance(message, dict):
+            return message.get("id")
+        return None
+
+    @staticmethod
+    def merge_messages(pending, message):
+        """Merge two notifications about the same resource into the one that should be processed.
+        A create followed by an update is still a create, while a delete followed by a create or an update
+        replaces the resource. Anything followed by a delete is just a delete.
+        """
+        if not isinstance(pending, dict) or not isinstance(message, dict):
+            return message
+        pending_type, message_type = pending.get("type"), message.get("type")
+        if pending_type == "create" and message_type == "update":
+            return {**message, "type": "create"}
+        if pending_type in ["update", "delete"] and message_type == "create":
+            return {**message, "type": "update"}
+        return message
+
     def consume(self, callback):
         if self.consumer is None:
             self.consumer = self.get_consumer(callback)
@@ -0,0 +1,76 @@
+import logging
+import queue
+import threading
+from typing import Callable, List, Optional
+
+from importer.dto.import_work_item import ImportWorkItem
+
+LOG = logging.getLogger(__name__)
+
+
+class PipelineStage:
+    def __init__(self, name: str, handler: Callable[[ImportWorkItem], bool], workers: int, queue_size: int):
+        """
+        Pipeline step, processing work items with its own pool of threads.
+        :param name:        stage name, used for the threads and in the logs
+        :param handler:     function processing a work item, returning False when the item needs no further stages
+        :param workers:     number of items processed concurrently by this stage
+        :param queue_size:  max number of items waiting for this stage, producers block when it is full
+        """
+        self.name = name
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.next_stage: Optional[PipelineStage] = None
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{index}", daemon=True) for index in range(max(1, workers))
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item: ImportWorkItem):
+        self.queue.put(item)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                proceed = self.handler(item)
+            except Exception as e:
+                LOG.error(f"Stage {self.name} failed for resource {item.message.id}: {e}", exc_info=True)
+                item.error = e
+                proceed = False
+            if proceed and self.next_stage is not None:
+                self.next_stage.put(item)
+            else:
+                item.done.set()
+
+    def stop(self):
+        for _ in self._threads:
+            self.queue.put(None)
+
+
+class PipelineManager:
+    def __init__(self, stages: List[PipelineStage]):
+        """
+        Chains the stages through their bounded queues, so that network and CPU bound steps of different
+        items overlap, while each stage keeps its own concurrency limit and backpressure.
+        """
+        self.stages = stages
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next_stage = next_stage
+        for stage in stages:
+            stage.start()
+
+    def process(self, item: ImportWorkItem) -> ImportWorkItem:
+        """Submit an item to the first stage and wait until it leaves the pipeline"""
+        self.stages[0].put(item)
+        item.done.wait()
+        return item
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
@@ -0,0 +1,77 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from importer.database.extensions import db_session
+from importer.manager.data_storage_manager import DataStorageManager
+from importer.settings.instance import settings
+
+LOG = logging.getLogger(__name__)
+
+
+class PurgeManager:
+    """
+    Purges soft-deleted resources in a background thread, every purge_interval seconds.
+    The PostGIS tables of deleted vector layers are dropped, and the tombstones moved to geoserver_resource_archive,
+    so that geoserver_resource only holds live layers.
+    The same thread adds the monthly partitions of geoserver_resource, when it is partitioned.
+    """
+
+    def __init__(self, data_storage_manager: DataStorageManager):
+        self.data_storage_manager = data_storage_manager
+        self.after_hours = settings.purge_after_hours
+        self.interval = settings.purge_interval
+        self.batch_size = max(1, settings.purge_batch_size)
+        self.lock_timeout = settings.purge_lock_timeout
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="purge", daemon=True)
+
+    def start(self):
+        if self.after_hours <= 0:
+            LOG.info("Purge of deleted resources disabled")
+        else:
+            LOG.info(
+                f"Purging resources deleted more than {self.after_hours} hours ago, every {self.interval} seconds"
+            )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def purge(self):
+        """Purges the resources deleted more than purge_after_hours ago, one batch per transaction"""
+        if self.after_hours <= 0:
+            return
+        deleted_before = datetime.utcnow() - timedelta(hours=self.after_hours)
+        dropped_tables, archived_rows = 0, 0
+        while not self._stopped.is_set():
+            with db_session() as session:
+                dropped, archived = self.data_storage_manager.purge_deleted_resources(
+                    session, deleted_before, batch_size=self.batch_size, lock_timeout=self.lock_timeout
+                )
+            dropped_tables += dropped
+            archived_rows += archived
+            # a batch of tables all locked archives nothing, they are retried at the next purge
+            if archived == 0:
+                break
+        if archived_rows:
+            LOG.info(f"Purged deleted resources: {dropped_tables} tables dropped, {archived_rows} rows archived")
+
+    def create_partitions(self):
+        """Keeps monthly partitions ahead of the current date, when geoserver_resource is partitioned"""
+        with db_session() as session:
+            created = self.data_storage_manager.create_resource_partitions(session, settings.partitions_ahead)
+        if created:
+            LOG.info(f"Created {created} monthly partitions of geoserver_resource")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.create_partitions()
+            except Exception as e:
+                LOG.error(e, exc_info=True)
+            try:
+                self.purge()
+            except Exception as e:
+                LOG.error(e, exc_info=True)
+            self._stopped.wait(self.interval)
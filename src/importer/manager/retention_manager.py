@@ -0,0 +1,201 @@
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from importer.database.extensions import db_session
+from importer.manager.data_storage_manager import DataStorageManager
+from importer.manager.geoserver_manager import GeoserverManager
+from importer.settings.instance import settings
+
+LOG = logging.getLogger(__name__)
+
+
+class RetentionManager:
+    """
+    Deletes expired resources in a background thread.
+    Keeps a min-heap with the next expiry time of every (workspace, datatype) pair, computed from
+    expire_on, delete_after_days and delete_after_count, and sleeps until the earliest one is due.
+    """
+
+    def __init__(self, data_storage_manager: DataStorageManager, geoserver_manager: GeoserverManager):
+        self.data_storage_manager = data_storage_manager
+        self.geoserver_manager = geoserver_manager
+        self.batch_size = max(1, settings.retention_batch_size)
+        self.min_interval = settings.retention_min_interval
+        self.dry_run = settings.retention_dry_run
+        # heap of (due timestamp, workspace, datatype_id), stale entries are skipped when popped
+        self._heap: List[Tuple[float, str, str]] = []
+        self._scheduled: Dict[Tuple[str, str], float] = {}
+        # when each (workspace, datatype_id) was last checked, to honour retention_min_interval
+        self._last_checked: Dict[Tuple[str, str], float] = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+
+    def start(self):
+        """Schedules every datatype having live resources, then starts the scheduler thread"""
+        with db_session() as session:
+            for workspace in self.data_storage_manager.get_workspaces(session):
+                due_dates = self.data_storage_manager.get_retention_due_dates(session, workspace)
+                for datatype_id, due in due_dates.items():
+                    self._push(workspace, datatype_id, due.timestamp())
+        LOG.info(f"Retention scheduler started with {len(self._scheduled)} datatypes, dry run: {self.dry_run}")
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def schedule(self, workspace: str, datatype_ids: List[str]):
+        """
+        Updates the next expiry time of the given datatypes, e.g. after new resources have been imported.
+        The scheduler thread is woken up only if one of them is now due earlier, and never checks the same
+        datatype twice within retention_min_interval seconds.
+        :param workspace:    workspace of the datatypes
+        :param datatype_ids: datatypes to check
+        """
+        if not datatype_ids:
+            return
+        with db_session() as session:
+            due_dates = self.data_storage_manager.get_retention_due_dates(session, workspace, datatype_ids)
+        with self._condition:
+            earliest = self._heap[0][0] if self._heap else None
+            for datatype_id, due in due_dates.items():
+                last_checked = self._last_checked.get((workspace, datatype_id), 0)
+                self._push(workspace, datatype_id, max(due.timestamp(), last_checked + self.min_interval))
+            if self._heap and (earliest is None or self._heap[0][0] < earliest):
+                self._condition.notify()
+
+    def report(self, limit: int = 10) -> List[dict]:
+        """
+        Dry-run report of the upcoming deletions, sorted by due time.
+        :param limit: maximum number of entries
+        :return:      list of dicts with workspace, datatype_id, due time and the resources already expired
+        """
+        with self._condition:
+            upcoming = heapq.nsmallest(limit, ((due, key) for key, due in self._scheduled.items()))
+        now = datetime.utcnow()
+        report = []
+        with db_session() as session:
+            for due, (workspace, datatype_id) in upcoming:
+                expired_ids = self.data_storage_manager.get_expired_resource_ids(
+                    session, workspace, datatype_ids=[datatype_id], now=now
+                )
+                expired = self.data_storage_manager.get_resources_by_ids(session, expired_ids)
+                report.append(
+                    {
+                        "workspace": workspace,
+                        "datatype_id": datatype_id,
+                        "due": datetime.fromtimestamp(due, timezone.utc),
+                        "expired_resources": sorted(set(r.resource_id for r in expired)),
+                    }
+                )
+        return report
+
+    def _push(self, workspace: str, datatype_id: str, due: float):
+        key = (workspace, datatype_id)
+        current = self._scheduled.get(key)
+        if current is not None and current <= due:
+            return
+        self._scheduled[key] = due
+        heapq.heappush(self._heap, (due, workspace, datatype_id))
+
+    def _pop_due(self) -> Optional[Dict[str, List[str]]]:
+        """Waits until at least one entry is due, returns the due datatypes grouped by workspace"""
+        with self._condition:
+            while not self._stopped:
+                now = time.time()
+                due_datatypes = {}
+                while self._heap and self._heap[0][0] <= now:
+                    due, workspace, datatype_id = heapq.heappop(self._heap)
+                    if self._scheduled.get((workspace, datatype_id)) != due:
+                        continue
+                    del self._scheduled[(workspace, datatype_id)]
+                    self._last_checked[(workspace, datatype_id)] = now
+                    due_datatypes.setdefault(workspace, []).append(datatype_id)
+                if due_datatypes:
+                    return due_datatypes
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._condition.wait(timeout)
+        return None
+
+    def _run(self):
+        while True:
+            due_datatypes = self._pop_due()
+            if due_datatypes is None:
+                break
+            for workspace, datatype_ids in due_datatypes.items():
+                try:
+                    self.delete_expired_resources(workspace, datatype_ids)
+                except Exception as e:
+                    LOG.error(e, exc_info=True)
+                try:
+                    self._reschedule(workspace, datatype_ids)
+                except Exception as e:
+                    LOG.error(e, exc_info=True)
+                    with self._condition:
+                        for datatype_id in datatype_ids:
+                            self._push(workspace, datatype_id, time.time() + self.min_interval)
+
+    def _reschedule(self, workspace: str, datatype_ids: List[str]):
+        with db_session() as session:
+            due_dates = self.data_storage_manager.get_retention_due_dates(session, workspace, datatype_ids)
+        # avoid busy loops when deletions keep failing or are only reported (dry run)
+        earliest = time.time() + self.min_interval
+        with self._condition:
+            for datatype_id, due in due_dates.items():
+                self._push(workspace, datatype_id, max(due.timestamp(), earliest))
+
+    def delete_expired_resources(self, workspace: str, datatype_ids: List[str]):
+        """
+        Deletes the expired resources of the given datatypes, in batches of retention_batch_size layers,
+        each one in its own transaction.
+        :param workspace:    workspace of the datatypes
+        :param datatype_ids: datatypes to check
+        """
+        with db_session() as session:
+            expired_ids = self.data_storage_manager.get_expired_resource_ids(session, workspace, datatype_ids)
+        if not expired_ids:
+            return
+        if self.dry_run:
+            LOG.info(f"[dry run] {len(expired_ids)} expired layers due for deletion (datatype {datatype_ids})")
+            return
+        for start in range(0, len(expired_ids), self.batch_size):
+            batch_ids = expired_ids[start : start + self.batch_size]
+            with db_session() as session:
+                keys = [
+                    (workspace, r.resource_id)
+                    for r in self.data_storage_manager.get_resources_by_ids(session, batch_ids)
+                ]
+            # an import of the same resource may republish under the same layer, store and file names meanwhile
+            with self.data_storage_manager.resource_locks.hold(keys):
+                self._delete_expired_batch(datatype_ids, batch_ids)
+
+    def _delete_expired_batch(self, datatype_ids: List[str], ids: List[int]):
+        """Deletes the expired resources still live among the given ids, to be called holding their resource locks"""
+        with db_session() as session:
+            expired_resources = self.data_storage_manager.get_resources_by_ids(session, ids, live=True)
+            if not expired_resources:
+                return
+            LOG.info(
+                f"Expired resources to delete (datatype {datatype_ids}): "
+                f"{[r.resource_id for r in expired_resources]}"
+            )
+            reslayercount = self.data_storage_manager.countlayers_perresource(
+                session=session, resources=expired_resources
+            )
+            # detached, so that no transaction stays open while GeoServer is called
+            session.expunge_all()
+        errors = self.geoserver_manager.delete(resources=expired_resources, resourcelayercount=reslayercount)
+        deleted = [resource for resource in expired_resources if errors.get(resource.id) is None]
+        if len(deleted) < len(expired_resources):
+            LOG.warning(
+                f"{len(expired_resources) - len(deleted)} expired layers not deleted from GeoServer, "
+                f"retrying at the next sweep"
+            )
+        with db_session() as session:
+            self.data_storage_manager.delete_resources(session, deleted, resourcelayercount=reslayercount)
@@ -0,0 +1,143 @@
+import errno
+import logging
+import os
+import queue
+import threading
+import uuid
+from typing import List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm.session import Session
+
+from importer.database.session import SessionLocal
+from importer.settings.instance import settings
+
+LOG = logging.getLogger(__name__)
+
+# key of Session.info listing the (original path, trash path) moved by the current transaction
+SESSION_INFO_KEY = "trashed_paths"
+
+
+class TrashReaper:
+    """
+    Deletes files and folders of deleted resources without holding a transaction open.
+    Within the transaction they are only renamed into the trash folder, on the same volume of the GeoServer data.
+    After the commit a background thread unlinks them, at most trash_reaper_rate bytes per second,
+    while a rollback moves them back where they were.
+    """
+
+    def __init__(self, trash_folder: str, rate: int):
+        """
+        :param trash_folder: folder receiving the trashed paths, on the same filesystem of the data
+        :param rate:         bytes freed per second by the reaper, 0 for no limit
+        """
+        self.trash_folder = trash_folder
+        self.rate = rate
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        Starts the reaper thread, also removing what a previous run left in the trash.
+        To be called at startup, before any transaction moves paths to the trash.
+        """
+        os.makedirs(self.trash_folder, exist_ok=True)
+        leftovers = os.listdir(self.trash_folder)
+        for name in leftovers:
+            self._queue.put(os.path.join(self.trash_folder, name))
+        if leftovers:
+            LOG.info(f"Reaping {len(leftovers)} paths left in {self.trash_folder}")
+        self._start_thread()
+
+    def _start_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trash-reaper", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def trash(self, session: Session, path: str):
+        """
+        Moves a file or folder to the trash, to be deleted when the transaction of the session commits.
+        If the trash is on another filesystem the path is left in place and deleted after the commit.
+        :param session: session of the transaction deleting the resource
+        :param path:    file or folder to delete
+        """
+        trash_path = os.path.join(self.trash_folder, f"{uuid.uuid4().hex}_{os.path.basename(path)}")
+        try:
+            os.makedirs(self.trash_folder, exist_ok=True)
+            os.rename(path, trash_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            LOG.warning(f"{self.trash_folder} is not on the filesystem of {path}, it is deleted in place")
+            trash_path = path
+        LOG.info(f"Moved {path} to the trash")
+        session.info.setdefault(SESSION_INFO_KEY, []).append((path, trash_path))
+
+    def after_commit(self, session: Session):
+        trashed: List[Tuple[str, str]] = session.info.pop(SESSION_INFO_KEY, [])
+        if not trashed:
+            return
+        self._start_thread()
+        for _, trash_path in trashed:
+            self._queue.put(trash_path)
+
+    def after_rollback(self, session: Session):
+        trashed: List[Tuple[str, str]] = session.info.pop(SESSION_INFO_KEY, [])
+        for path, trash_path in reversed(trashed):
+            if path == trash_path:
+                continue
+            try:
+                os.rename(trash_path, path)
+                LOG.info(f"Restored {path} from the trash")
+            except OSError as e:
+                LOG.error(f"Cannot restore {path} from the trash: {e}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                path = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self._reap(path)
+            except Exception as e:
+                LOG.error(f"Cannot delete {path}: {e}")
+
+    def _reap(self, path: str):
+        if os.path.isdir(path) and not os.path.islink(path):
+            for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+                for filename in filenames:
+                    self._reap_file(os.path.join(dirpath, filename))
+                for dirname in dirnames:
+                    dirname = os.path.join(dirpath, dirname)
+                    if os.path.islink(dirname):
+                        os.remove(dirname)
+                    else:
+                        os.rmdir(dirname)
+            os.rmdir(path)
+        elif os.path.lexists(path):
+            self._reap_file(path)
+        LOG.debug(f"Deleted {path}")
+
+    def _reap_file(self, path: str):
+        size = 0 if os.path.islink(path) else os.lstat(path).st_size
+        if self.rate > 0:
+            # large files are shrunk a second's worth at a time, spreading the release of their extents
+            while size > self.rate:
+                size -= self.rate
+                os.truncate(path, size)
+                if self._stopped.wait(1):
+                    return
+            self._stopped.wait(size / self.rate)
+        os.remove(path)
+
+
+trash_reaper = TrashReaper(trash_folder=settings.get_trash_folder(), rate=settings.trash_reaper_rate)
+event.listen(SessionLocal, "after_commit", trash_reaper.after_commit)
+event.listen(SessionLocal, "after_rollback", trash_reaper.after_rollback)
@@ -15,6 +15,35 @@ class ProjectSettings(BaseSettings):
     # Importer settings
     delete_after_days: int = 0  # if 0, never delete
     delete_after_count: int = 0  # if 0, never delete
+    importer_workers: int = 1  # number of messages processed concurrently
+    importer_coalesce_window: float = 0  # seconds to wait for later notifications of the same resource, 0 disables
+    # concurrency of each ingest stage, the messages in flight are bounded by importer_workers
+    pipeline_download_workers: int = 2
+    pipeline_store_workers: int = 1
+    pipeline_publish_workers: int = 2
+    pipeline_report_workers: int = 1
+    pipeline_queue_size: int = 4  # items waiting for each stage before upstream stages block
+    download_chunk_size: int = 1024 * 1024  # bytes written at a time while streaming downloads to disk
+    download_buffer_limit: int = 16 * 1024 * 1024  # archives larger than this (or of unknown size) go to disk
+    download_parallel_threshold: int = 256 * 1024 * 1024  # larger files use parallel range requests, if supported
+    download_segments: int = 4  # max number of parallel range requests per file
+    download_min_segment_size: int = 64 * 1024 * 1024
+    download_retries: int = 3  # attempts to resume each interrupted segment
+    vector_reader_arrow: bool = True  # read vector files with pyogrio and Arrow, instead of Fiona
+    cog_workers: int = 2  # processes rewriting GeoTIFFs as COG, for datatypes with "cog" in their parameters
+    # downloads are extracted here, on the same volume as geoserver_data_dir files are moved instead of copied
+    importer_staging_dir: str = "temp"
+    # deleted files are renamed here within the transaction, and unlinked in background after the commit.
+    # Relative to geoserver_data_dir, it must be on the same volume for the rename to be O(1)
+    importer_trash_dir: str = ".trash"
+    trash_reaper_rate: int = 128 * 1024 * 1024  # bytes per second freed by the reaper, 0 for no limit
+    retention_batch_size: int = 50  # expired layers deleted per transaction by the retention scheduler
+    retention_min_interval: int = 60  # minimum seconds between two retention checks of the same datatype
+    retention_dry_run: bool = False  # if true, expired layers are only reported, never deleted
+    purge_after_hours: int = 24  # deleted resources are purged after this many hours, 0 disables the purge
+    purge_interval: int = 3600  # seconds between two purges
+    purge_batch_size: int = 100  # deleted resources purged per transaction
+    purge_lock_timeout: int = 5000  # milliseconds to wait for the lock of a table to drop, else it is retried later
 
     # Webserver settings
     api_title: str = "Importer & Mapper API"
@@ -32,6 +61,8 @@ class ProjectSettings(BaseSettings):
     rabbitmq_cert_file: str
     rabbitmq_key_file: str
     rabbitmq_vhost: str
+    rabbitmq_heartbeat: int = 60  # seconds, serviced by the ioloop while messages are processed
+    rabbitmq_prefetch: int = 0  # if 0, match importer_workers. Raise it to coalesce bursts of notifications
 
     rabbitmq_exchange: str
     rabbitmq_exchange_type: str
@@ -53,6 +84,10 @@ class ProjectSettings(BaseSettings):
     database_name: str
     database_user: str
     database_pass: str
+    postgis_copy_batch_size: int = 50000  # rows streamed by each COPY while loading vector layers
+    layer_settings_cache_ttl: int = 300  # seconds the layer settings are kept in memory, 0 disables the cache
+    layer_settings_cache_listen: bool = True  # LISTEN for changes of layer_settings to invalidate the cache
+    partitions_ahead: int = 3  # monthly partitions of geoserver_resource kept ahead, if partitioned
 
     # Geoserver settings
     geoserver_admin_user: str
@@ -64,6 +99,7 @@ class ProjectSettings(BaseSettings):
     geoserver_workspace: str = "gaia"
     geoserver_tif_folder: str = "geotiff"
     geoserver_imagemosaic_folder: str = "imagemosaic"
+    geoserver_max_concurrency: int = 8  # REST requests sent concurrently to GeoServer by each process
 
     @property
     def app_version(self):
@@ -160,6 +196,13 @@ class ProjectSettings(BaseSettings):
             "Authorization": f"Bearer {access_token}",
         }
 
+    def get_staging_folder(self):
+        os.makedirs(self.importer_staging_dir, exist_ok=True)
+        return self.importer_staging_dir
+
+    def get_trash_folder(self):
+        return os.path.join(self.geoserver_data_dir, self.importer_trash_dir)
+
     def get_temp_folder(self):
         temp_folder = os.path.join(self.geoserver_data_dir, "temp")
         if not os.path.exists(temp_folder):
@@ -0,0 +1,50 @@
+import logging
+import os
+
+import rasterio
+import rasterio.shutil
+
+LOG = logging.getLogger(__name__)
+
+# creation options of the GDAL COG driver, overridden by the "cog" entry of layer_settings.parameters
+DEFAULT_COG_OPTIONS = {
+    "COMPRESS": "DEFLATE",
+    "BLOCKSIZE": 512,
+    "OVERVIEW_RESAMPLING": "AVERAGE",
+    "BIGTIFF": "IF_SAFER",
+}
+
+
+def is_cog(path: str) -> bool:
+    """Whether a GeoTIFF is already tiled, compressed and with overviews (when larger than a tile)"""
+    with rasterio.open(path) as src:
+        if src.driver != "GTiff":
+            return False
+        if src.tags(ns="IMAGE_STRUCTURE").get("LAYOUT", "").upper() == "COG":
+            return True
+        block_height, block_width = src.block_shapes[0]
+        tiled = src.profile.get("tiled", False) and block_height == block_width
+        needs_overviews = max(src.width, src.height) > block_width
+        return bool(tiled and src.compression and (src.overviews(1) or not needs_overviews))
+
+
+def convert_to_cog(path: str, options: dict = None) -> bool:
+    """
+    Rewrites a GeoTIFF in place as a Cloud-Optimized GeoTIFF, unless it already is one.
+    Meant to run in a process pool, hence it only takes and returns picklable values.
+    :param path:    path of the GeoTIFF
+    :param options: creation options of the GDAL COG driver, case insensitive
+    :return:        whether the file has been rewritten
+    """
+    if is_cog(path):
+        return False
+    creation_options = dict(DEFAULT_COG_OPTIONS)
+    creation_options.update({key.upper(): value for key, value in (options or {}).items()})
+    tmp_path = f"{path}.cog.tif"
+    try:
+        rasterio.shutil.copy(path, tmp_path, driver="COG", **creation_options)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
@@ -1,5 +1,11 @@
 import datetime
+import logging
 import re
+from typing import List
+
+import pandas as pd
+
+LOG = logging.getLogger(__name__)
 
 
 def set_utc_default_tz(timestamp: datetime.datetime) -> datetime.datetime:
@@ -15,3 +21,15 @@ def isoformat_Z(
 ) -> str:
     """Return the timestamp in isoformat, with UTC timezone expressed as Z"""
     return re.sub(zpattern, "", timestamp.isoformat(timespec=timespec)) + "Z" if timestamp else timestamp
+
+
+def distinct_isoformat_Z(values: pd.Series) -> List[str]:
+    """Return the sorted distinct timestamps of a series, in UTC isoformat with milliseconds and Z (vectorized)"""
+    # every value is parsed on its own ISO 8601 shape, instead of the format inferred from the first one
+    parsed = pd.to_datetime(values, utc=True, errors="coerce", format="ISO8601")
+    invalid = values[parsed.isna() & values.notna()]
+    if not invalid.empty:
+        LOG.warning(f"Ignoring {len(invalid)} values that are not ISO 8601 timestamps, e.g. {invalid.iloc[0]!r}")
+    timestamps = parsed.dropna().drop_duplicates()
+    formatted = timestamps.dt.strftime("%Y-%m-%dT%H:%M:%S.%f").str[:-3] + "Z"
+    return sorted(formatted.tolist())
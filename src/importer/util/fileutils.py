@@ -0,0 +1,63 @@
+import errno
+import fcntl
+import logging
+import os
+import shutil
+
+LOG = logging.getLogger(__name__)
+
+# ioctl cloning a whole file on filesystems supporting reflinks (btrfs, xfs), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def place_file(source: str, destination: str) -> str:
+    """
+    Moves a file to its destination avoiding copies whenever possible, replacing any existing file.
+    The file is moved with an atomic rename if both paths are on the same filesystem. Otherwise it is cloned
+    (reflink), then copied in kernel with copy_file_range, and copied in user space only as a last resort.
+    Copies are written aside and renamed when complete, then the source is removed.
+    :param source:      file to move
+    :param destination: final path of the file
+    :return:            name of the strategy that succeeded, for logging
+    """
+    try:
+        os.replace(source, destination)
+        return "rename"
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp_destination = f"{destination}.part"
+    for strategy in (_clone, _copy_file_range, _copy):
+        try:
+            strategy(source, tmp_destination)
+        except OSError as e:
+            LOG.debug(f"{strategy.__name__} failed from {source} to {destination}: {e}")
+            if os.path.exists(tmp_destination):
+                os.remove(tmp_destination)
+            if strategy is _copy:
+                raise
+            continue
+        os.replace(tmp_destination, destination)
+        os.remove(source)
+        return strategy.__name__.strip("_")
+
+
+def _clone(source: str, destination: str):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def _copy_file_range(source: str, destination: str):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOTSUP, "copy_file_range not available")
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+            if copied == 0:
+                raise OSError(errno.EIO, "copy_file_range stopped before the end of the file")
+            remaining -= copied
+
+
+def _copy(source: str, destination: str):
+    shutil.copyfile(source, destination)
@@ -0,0 +1,33 @@
+import threading
+from contextlib import contextmanager
+from typing import Hashable, Iterable, Set
+
+
+class KeyedLock:
+    """
+    Mutual exclusion on arbitrary keys, e.g. the resources being imported or deleted.
+    Unlike threading.Lock a key is not owned by a thread: threads holding different keys never wait on each other.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._held: Set[Hashable] = set()
+
+    @contextmanager
+    def hold(self, keys: Iterable[Hashable]):
+        """
+        Blocks until none of the keys is held by someone else, then holds all of them until the block exits.
+        Keys are taken all at once, so holders of overlapping sets of keys cannot deadlock.
+        :param keys: keys to hold
+        """
+        keys = set(keys)
+        with self._condition:
+            while not self._held.isdisjoint(keys):
+                self._condition.wait()
+            self._held.update(keys)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._held.difference_update(keys)
+                self._condition.notify_all()
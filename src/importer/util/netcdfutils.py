@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+from typing import List
+
+import netCDF4
+import numpy
+import xarray
+
+LOG = logging.getLogger(__name__)
+
+
+def time_axis_cache_path(path: str) -> str:
+    """Path of the file caching the time axis of a NetCDF, next to it"""
+    return f"{path}.times.json"
+
+
+def read_time_axis(path: str, variable: str = "time") -> List[str]:
+    """
+    Return the timestamps of the time coordinate of a NetCDF, in UTC isoformat with milliseconds and Z.
+    Only the header and the time variable are read, and the result is cached next to the file,
+    valid as long as the file size and modification time do not change.
+    :param path:     path of the NetCDF file
+    :param variable: name of the time coordinate variable
+    """
+    stat = os.stat(path)
+    cache_path = time_axis_cache_path(path)
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["timestamps"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    times = _decode_time_axis(path, variable)
+    timestamps = [numpy.datetime_as_string(t, unit="ms", timezone="UTC") for t in times]
+    try:
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "timestamps": timestamps}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        LOG.warning(f"Cannot cache the time axis of {path}: {e}")
+    return timestamps
+
+
+def _decode_time_axis(path: str, variable: str) -> numpy.ndarray:
+    try:
+        with netCDF4.Dataset(path) as dataset:
+            time_variable = dataset.variables[variable]
+            dates = netCDF4.num2date(
+                time_variable[:],
+                units=time_variable.units,
+                calendar=getattr(time_variable, "calendar", "standard"),
+                only_use_cftime_datetimes=False,
+                only_use_python_datetimes=True,
+            )
+        return numpy.array(numpy.ma.getdata(dates), dtype="datetime64[ms]").ravel()
+    except Exception as e:
+        # e.g. HDF5 files not readable by netCDF4, or unusual units, decoded lazily by xarray
+        LOG.debug(f"netCDF4 cannot decode the time axis of {path}, using xarray: {e}")
+    with xarray.open_dataset(path) as dataset:
+        return dataset[variable].values
@@ -0,0 +1,27 @@
+import csv
+import io
+
+import pandas as pd
+
+# marker of missing values in the CSV streamed to COPY, an empty field would be read as an empty string once quoted
+COPY_NULL = r"\N"
+
+
+def to_copy_csv(df: pd.DataFrame) -> io.StringIO:
+    """
+    Serializes a dataframe as CSV for COPY ... FROM STDIN, see copy_options.
+    Strings are quoted, so that empty strings stay distinct from missing values (NaN, None, NaT).
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=False, index=False, quoting=csv.QUOTE_NONNUMERIC, na_rep=COPY_NULL)
+    buffer.seek(0)
+    return buffer
+
+
+def copy_options(columns) -> str:
+    """
+    Options of COPY matching to_copy_csv: QUOTE_NONNUMERIC also quotes the null marker,
+    hence FORCE_NULL on every column turns both "\\N" and \\N into NULL.
+    :param columns: quoted names of the columns being loaded
+    """
+    return f"FORMAT csv, NULL '{COPY_NULL}', FORCE_NULL ({', '.join(columns)})"
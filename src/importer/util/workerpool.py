@@ -0,0 +1,93 @@
+import logging
+import queue
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, Optional
+
+LOG = logging.getLogger(__name__)
+
+
+class KeyedWorkerPool:
+    """
+    Pool of worker threads consuming a shared task queue.
+    Tasks submitted with the same key are executed one at a time and in submission order,
+    while tasks with different keys (or without a key) run concurrently.
+    """
+
+    def __init__(self, workers: int, name: str = "worker"):
+        """
+        Initializes the pool and starts the worker threads.
+        :param workers: number of worker threads
+        :param name:    prefix of the thread names, useful in the logs
+        """
+        self._tasks = queue.Queue()
+        self._lock = threading.Lock()
+        # notified when a key has no more tasks, see shutdown
+        self._released = threading.Condition(self._lock)
+        # keys currently being processed, each one with the tasks waiting for it
+        self._active: Dict[Hashable, deque] = {}
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{index}", daemon=True) for index in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def size(self) -> int:
+        return len(self._threads)
+
+    def submit(self, key: Optional[Hashable], fn: Callable, *args: Any):
+        """
+        Schedules fn(*args) for execution.
+        :param key: ordering key, tasks sharing it never run concurrently. None means no ordering constraint
+        :param fn:  function to execute in a worker thread
+        """
+        if key is not None:
+            with self._lock:
+                if key in self._active:
+                    self._active[key].append((fn, args))
+                    return
+                self._active[key] = deque()
+        self._tasks.put((key, fn, args))
+
+    def _run(self):
+        while True:
+            item = self._tasks.get()
+            if item is None:
+                break
+            key, fn, args = item
+            try:
+                fn(*args)
+            except Exception as e:
+                LOG.error(e, exc_info=True)
+            finally:
+                if key is not None:
+                    self._release(key)
+
+    def _release(self, key: Hashable):
+        with self._lock:
+            pending = self._active[key]
+            if pending:
+                fn, args = pending.popleft()
+                self._tasks.put((key, fn, args))
+            else:
+                del self._active[key]
+                self._released.notify_all()
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the workers once the queued tasks have been processed.
+        Tasks waiting for their key are re-queued as the previous ones complete, so the workers are stopped
+        only after every key has been released.
+        :param wait: whether to block until every worker has terminated
+        """
+        if not wait:
+            threading.Thread(target=self.shutdown, name="worker-shutdown", daemon=True).start()
+            return
+        with self._released:
+            while self._active:
+                self._released.wait()
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,13 @@
+import pandas as pd
+
+from importer.util.datetimeutils import distinct_isoformat_Z
+
+
+def test_mixed_iso_shapes_are_all_parsed():
+    values = pd.Series(["2024-01-01T00:00:00", "2024-01-02", "2024-01-02T00:00:00+00:00"])
+    assert distinct_isoformat_Z(values) == ["2024-01-01T00:00:00.000Z", "2024-01-02T00:00:00.000Z"]
+
+
+def test_invalid_values_are_dropped():
+    values = pd.Series(["2024-01-01T12:30:00Z", "not a date", None])
+    assert distinct_isoformat_Z(values) == ["2024-01-01T12:30:00.000Z"]
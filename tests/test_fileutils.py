@@ -0,0 +1,10 @@
+from importer.util.fileutils import place_file
+
+
+def test_place_file_replaces_destination_and_removes_source(tmp_path):
+    source, destination = tmp_path / "source.tif", tmp_path / "destination.tif"
+    source.write_bytes(b"new")
+    destination.write_bytes(b"old")
+    assert place_file(str(source), str(destination)) == "rename"
+    assert destination.read_bytes() == b"new"
+    assert not source.exists()
@@ -0,0 +1,22 @@
+import threading
+
+from importer.util.keyedlock import KeyedLock
+
+
+def test_hold_waits_for_overlapping_keys():
+    lock = KeyedLock()
+    entered = threading.Event()
+
+    def hold_b_and_c():
+        with lock.hold(["b", "c"]):
+            entered.set()
+
+    with lock.hold(["a", "b"]):
+        thread = threading.Thread(target=hold_b_and_c)
+        thread.start()
+        assert not entered.wait(0.1)
+        # disjoint keys are not blocked
+        with lock.hold(["c"]):
+            pass
+    thread.join(1)
+    assert entered.is_set()
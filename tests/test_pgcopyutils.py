@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from importer.util.pgcopyutils import COPY_NULL, copy_options, to_copy_csv
+
+
+def test_missing_values_are_written_as_null_marker():
+    df = pd.DataFrame(
+        {
+            "Index": [0, 1],
+            "value": [1.5, np.nan],
+            "name": ["a", None],
+            "time": pd.to_datetime(["2024-01-01T00:00:00", None]),
+            "geometry": ["0101000020E6100000000000000000F03F000000000000F03F", None],
+        }
+    )
+    lines = to_copy_csv(df).read().splitlines()
+    assert lines[0].startswith('0,1.5,"a","2024-01-01')
+    fields = lines[1].split(",")
+    assert fields[0] == "1"
+    # quoted or not, every missing value carries the marker, never an empty field
+    assert all(field.strip('"') == COPY_NULL for field in fields[1:])
+
+
+def test_empty_strings_stay_distinct_from_missing_values():
+    lines = to_copy_csv(pd.DataFrame({"name": ["", None]})).read().splitlines()
+    assert lines[0] == '""'
+    assert lines[1].strip('"') == COPY_NULL
+
+
+def test_copy_options_force_null_on_every_column():
+    assert copy_options(['"Index"', '"name"']) == "FORMAT csv, NULL '\\N', FORCE_NULL (\"Index\", \"name\")"
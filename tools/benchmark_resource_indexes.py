@@ -0,0 +1,131 @@
+"""
+Shows how the indexes of migration 8_resource_hot_indexes change the plan of the /layers query.
+
+The query built by api.dashboard.domain.get_resources is explained with the indexes, then again after dropping them.
+Everything runs in a single transaction which is rolled back at the end, so the database is left untouched,
+but the dropped indexes keep geoserver_resource locked meanwhile: do not run it against a busy production database.
+
+Set DATABASE_HOST, DATABASE_PORT, DATABASE_NAME, DATABASE_USER and DATABASE_PASS (e.g. in a .env file), then:
+
+    python benchmark_resource_indexes.py --workspace ermes --datatype 33002 --seed 1000000
+
+--seed inserts synthetic live and deleted layers before explaining, rolled back as well.
+"""
+import argparse
+import os
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INDEXES = [
+    "ix_geoserver_resource_live_datatype",
+    "ix_geoserver_resource_validity",
+    "ix_geoserver_resource_bbox",
+    # spatial index created by geoalchemy with the table, if any
+    "idx_geoserver_resource_bbox",
+]
+
+# same filters of get_resources, for a workspace, a datatype, a time range and a bounding box
+QUERY = """
+SELECT * FROM geoserver_resource
+WHERE workspace = %(workspace)s
+  AND deleted_at IS NULL
+  AND datatype_id IN (%(datatype)s)
+  AND dest_org IS NULL
+  AND ST_Intersects(bbox, ST_MakeEnvelope(%(xmin)s, %(ymin)s, %(xmax)s, %(ymax)s, 4326))
+  AND "end" >= %(start)s
+  AND %(end)s >= start
+ORDER BY created_at DESC
+"""
+
+SEED = """
+INSERT INTO geoserver_resource (
+    datatype_id, workspace, store_name, layer_name, storage_location, created_at, deleted_at,
+    start, "end", resource_id, bbox, timestamps, mosaic
+)
+SELECT
+    (33000 + i %% 50)::text,
+    %(workspace)s,
+    'postgis_db',
+    'benchmark_' || i,
+    NULL,
+    created_at,
+    CASE WHEN i %% 4 = 0 THEN created_at + interval '1 day' END,
+    created_at,
+    created_at + interval '1 day',
+    'benchmark_' || i,
+    ST_Multi(ST_MakeEnvelope(x, y, x + 1, y + 1, 4326)),
+    '',
+    false
+FROM (
+    SELECT
+        i,
+        (now() AT TIME ZONE 'UTC') - (i %% 1095) * interval '1 day' AS created_at,
+        -20 + (i * 7) %% 60 AS x,
+        30 + (i * 13) %% 40 AS y
+    FROM generate_series(1, %(rows)s) AS i
+) AS seed
+"""
+
+
+def explain(cursor, params):
+    started = time.perf_counter()
+    cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {QUERY}", params)
+    plan = "\n".join(row[0] for row in cursor.fetchall())
+    return plan, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workspace", default="ermes")
+    parser.add_argument("--datatype", default="33002")
+    parser.add_argument("--bbox", default="5,35,20,48", help="xmin,ymin,xmax,ymax in EPSG:4326")
+    parser.add_argument("--start", default="2024-01-01")
+    parser.add_argument("--end", default="2024-03-01")
+    parser.add_argument("--seed", type=int, default=0, help="synthetic rows inserted before explaining")
+    args = parser.parse_args()
+
+    xmin, ymin, xmax, ymax = (float(coord) for coord in args.bbox.split(","))
+    params = dict(
+        workspace=args.workspace,
+        datatype=args.datatype,
+        xmin=xmin,
+        ymin=ymin,
+        xmax=xmax,
+        ymax=ymax,
+        start=args.start,
+        end=args.end,
+    )
+    connection = psycopg2.connect(
+        host=os.getenv("DATABASE_HOST"),
+        port=os.getenv("DATABASE_PORT"),
+        dbname=os.getenv("DATABASE_NAME"),
+        user=os.getenv("DATABASE_USER"),
+        password=os.getenv("DATABASE_PASS"),
+    )
+    try:
+        with connection.cursor() as cursor:
+            if args.seed:
+                cursor.execute(SEED, dict(workspace=args.workspace, rows=args.seed))
+                print(f"Inserted {args.seed} synthetic rows")
+            cursor.execute("ANALYZE geoserver_resource")
+            cursor.execute("SELECT count(*) FROM geoserver_resource")
+            print(f"geoserver_resource rows: {cursor.fetchone()[0]}\n")
+
+            plan, elapsed = explain(cursor, params)
+            print(f"=== With the indexes ({elapsed * 1000:.1f} ms) ===\n{plan}\n")
+
+            for index in INDEXES:
+                cursor.execute(f"DROP INDEX IF EXISTS {index}")
+            plan, elapsed = explain(cursor, params)
+            print(f"=== Without the indexes ({elapsed * 1000:.1f} ms) ===\n{plan}")
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()